@@ -1,16 +1,38 @@
 import streamlit as st
-import pandas as pd
 import os
 import zipfile
 import re
+import io
 from io import BytesIO
 import subprocess
 import sys
+import argparse
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import xml.etree.ElementTree as ET # For XML parsing and reconstruction
+import codecs
+import tempfile
+import shutil
+import hashlib
+import gzip
+from importlib import metadata
+import threading
+from collections import OrderedDict
+import time
+import json
+import csv
+import string
+import html.entities
+import uuid
+from contextlib import contextmanager
+from streamlit.logger import get_logger
+from xml.parsers import expat # For streaming (incremental) XML parsing
+from xml.sax.saxutils import escape
+import tagging_worker
 
-# Import language libraries
-from fugashi import Tagger # For Japanese
-from textblob import TextBlob # For English
+# Language libraries (fugashi for Japanese, TextBlob/NLTK for English) are
+# imported on first use, so only the selected backend is ever loaded.
 
 
 # --- Global Configuration and State Management ---
@@ -20,6 +42,7 @@ from textblob import TextBlob # For English
 def get_japanese_tokenizer():
     """Initializes and returns the Fugashi Tagger with unidic-lite."""
     try:
+        from fugashi import Tagger
         tagger = Tagger()
         return tagger
     except Exception as e:
@@ -43,119 +66,2720 @@ def initialize_english_textblob():
     
     return True
 
-# Global Variables
-JAPANESE_TAGGER = get_japanese_tokenizer()
-ENGLISH_TAGGER_READY = initialize_english_textblob()
+# Inference engine for the English perceptron model: "numpy" (VectorizedPerceptronTagger) or "nltk".
+ENGLISH_TAGGER_ENGINE = os.environ.get("TAGGER_EN_ENGINE", "numpy")
+
+def build_english_tagger():
+    """Loads the averaged perceptron model and returns it wrapped in the configured engine."""
+    from nltk.tag.perceptron import PerceptronTagger
+    tagger = PerceptronTagger()
+    if ENGLISH_TAGGER_ENGINE == "numpy":
+        try:
+            return VectorizedPerceptronTagger.from_nltk(tagger)
+        except ImportError:
+            logger.info("numpy is not installed; tagging English with NLTK's perceptron")
+    return tagger
+
+@st.cache_resource
+def get_english_tagger():
+    """Loads the English POS model once and returns the tagger."""
+    try:
+        return build_english_tagger()
+    except Exception as e:
+        st.error(f"Error loading English POS model (averaged perceptron). Error: {e}")
+        return None
+
+# Directory for files built once and reused across runs: the English lemma table and the result cache.
+CACHE_DIR = os.environ.get("TAGGER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tokeniser-tagger"))
+
+# --- ENGLISH LEMMA TABLE ---
+# (lowercased form, WordNet POS) -> lemma, precomputed from WordNet so that
+# tagging never needs the WordNet corpus reader itself.
+ENGLISH_LEMMA_TABLE_PATH = os.environ.get("TAGGER_LEMMA_TABLE", os.path.join(CACHE_DIR, "english_lemmas.tsv.gz"))
+ENGLISH_LEMMA_TABLE_FORMAT_VERSION = 1
+WORDNET_POS = ("n", "v", "a", "r")
+
+def build_english_lemma_table(path):
+    """
+    Writes every inflected form WordNet's lemmatizer maps to a different
+    lemma, per POS, as gzipped 'form\tpos\tlemma' lines.
+
+    The candidate forms are the exception lists plus every lemma run
+    backwards through WordNet's detachment rules, which covers every form
+    morphy can change, so a form missing from the table is its own lemma.
+    """
+    from nltk.corpus import wordnet as wn
+    from nltk.stem import WordNetLemmatizer
+
+    lemmatizer = WordNetLemmatizer()
+    lines = []
+    for pos in WORDNET_POS:
+        candidates = set(wn._exception_map[pos])
+        for lemma in wn.all_lemma_names(pos):
+            if "_" in lemma:
+                continue  # Multi-word lemmas never match a single token
+            for old, new in wn.MORPHOLOGICAL_SUBSTITUTIONS[pos]:
+                if lemma.endswith(new):
+                    candidates.add(lemma[:len(lemma) - len(new)] + old)
+        for form in sorted(candidates):
+            lemma = lemmatizer.lemmatize(form, pos)
+            if lemma != form:
+                lines.append(f"{form}\t{pos}\t{lemma}\n")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix='.tmp')
+    with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+        f.write(f"#lemma-table\tv{ENGLISH_LEMMA_TABLE_FORMAT_VERSION};wordnet={wn.get_version()}\n")
+        f.writelines(lines)
+    os.replace(temp_path, path)
+    return len(lines)
+
+def read_english_lemma_table_version(path=ENGLISH_LEMMA_TABLE_PATH):
+    """Returns the version string in the table's header line, or None if there is no table."""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return f.readline().rstrip('\n').partition('\t')[2] or None
+    except OSError:
+        return None
+
+def open_english_lemma_table(path=ENGLISH_LEMMA_TABLE_PATH):
+    """Loads the lemma table into {pos: {form: lemma}}, building it from WordNet first if needed."""
+    if not os.path.exists(path):
+        build_english_lemma_table(path)
+    table = {pos: {} for pos in WORDNET_POS}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            form, pos, lemma = line.rstrip('\n').split('\t')
+            table[pos][form] = lemma
+    return table
+
+@st.cache_resource
+def get_english_lemma_table():
+    """Loads the English lemma table once; returns None (token used as lemma) if WordNet is unavailable."""
+    try:
+        return open_english_lemma_table()
+    except Exception as e:
+        pipeline_warning(f"English lemma table unavailable, tokens are used as lemmas. Error: {e}")
+        return None
+
+# Global Variables, filled in by load_language_backend on first use
+JAPANESE_TAGGER = None
+ENGLISH_TAGGER = None
+ENGLISH_LEMMAS = None
+ENGLISH_TAGGER_READY = False
+_LOADED_BACKENDS = set()
+
+def load_language_backend(lang_code):
+    """Initializes the backend for lang_code the first time it is needed."""
+    global JAPANESE_TAGGER, ENGLISH_TAGGER, ENGLISH_LEMMAS, ENGLISH_TAGGER_READY
+    if lang_code in _LOADED_BACKENDS:
+        return
+    if lang_code == "JP":
+        JAPANESE_TAGGER = get_japanese_tokenizer()
+    elif lang_code == "EN":
+        ENGLISH_TAGGER_READY = initialize_english_textblob()
+        if ENGLISH_TAGGER_READY:
+            ENGLISH_TAGGER = get_english_tagger()
+            ENGLISH_LEMMAS = get_english_lemma_table()
+    _LOADED_BACKENDS.add(lang_code)
+
+def init_language_backend(lang_code):
+    """
+    load_language_backend without Streamlit, for the CLI and worker
+    processes: st.cache_resource and st.error do nothing useful there, so a
+    tagger that fails to load raises instead. A missing lemma table is
+    reported with pipeline_warning and the tokens are used as lemmas.
+    """
+    global JAPANESE_TAGGER, ENGLISH_TAGGER, ENGLISH_LEMMAS, ENGLISH_TAGGER_READY
+    if lang_code in _LOADED_BACKENDS:
+        return
+    if lang_code == "JP":
+        from fugashi import Tagger
+        JAPANESE_TAGGER = Tagger()
+    elif lang_code == "EN":
+        ENGLISH_TAGGER = build_english_tagger()
+        try:
+            ENGLISH_LEMMAS = open_english_lemma_table()
+        except Exception as e:
+            ENGLISH_LEMMAS = None
+            pipeline_warning(f"English lemma table unavailable, tokens are used as lemmas. Error: {e}")
+        ENGLISH_TAGGER_READY = True
+    _LOADED_BACKENDS.add(lang_code)
+
+
+# --- Tagger Pool ---
+# Streamlit runs every browser session in its own script thread of one
+# process, so the cached tagger objects above would be shared between
+# sessions. Sessions instead check a tagger out of a per-language pool for the
+# duration of a run; the pool grows on demand up to TAGGER_POOL_SIZE instances.
+TAGGER_POOL_SIZE = int(os.environ.get("TAGGER_POOL_SIZE", "0")) or os.cpu_count() or 1
+
+class TaggerPool:
+    """
+    Bounded pool of tagger instances with checkout/return semantics.
+    Instances are built by factory when none is idle and fewer than size
+    exist; past that, checkout blocks until another thread returns one.
+    """
+
+    def __init__(self, factory, size, instances=()):
+        self.factory = factory
+        self.size = max(1, size)
+        self.idle = list(instances)
+        self.created = len(self.idle)
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def checkout(self):
+        """Lends an instance to the calling thread and takes it back when the block exits."""
+        with self.condition:
+            while not self.idle and self.created >= self.size:
+                self.condition.wait()
+            instance = self.idle.pop() if self.idle else None
+            if instance is None:
+                self.created += 1
+        if instance is None:
+            try:
+                instance = self.factory()
+            except BaseException:
+                with self.condition:
+                    self.created -= 1
+                    self.condition.notify()
+                raise
+        try:
+            yield instance
+        finally:
+            with self.condition:
+                self.idle.append(instance)
+                self.condition.notify()
+
+def new_pooled_tagger(lang_code):
+    """Builds one more tagger for lang_code's pool."""
+    if lang_code == "JP":
+        from fugashi import Tagger
+        return Tagger()
+    if lang_code == "EN":
+        if isinstance(ENGLISH_TAGGER, VectorizedPerceptronTagger):
+            return ENGLISH_TAGGER.copy()
+        return build_english_tagger()
+    raise ValueError(f"No tagger pool for language {lang_code!r}")
+
+@st.cache_resource
+def get_tagger_pool(lang_code):
+    """
+    Returns the process-wide tagger pool for lang_code, seeded with the
+    backend's already loaded tagger, or None if the backend failed to load.
+    """
+    load_language_backend(lang_code)
+    tagger = JAPANESE_TAGGER if lang_code == "JP" else ENGLISH_TAGGER
+    if tagger is None:
+        return None
+    return TaggerPool(lambda: new_pooled_tagger(lang_code), TAGGER_POOL_SIZE, [tagger])
+
+# Taggers checked out by the current thread, by language code
+_BORROWED_TAGGERS = threading.local()
+
+@contextmanager
+def borrow_tagger(lang_code, pool=None):
+    """
+    Checks a tagger for lang_code out of its pool (by default
+    get_tagger_pool(lang_code)) for the calling thread, so the tagging
+    functions use it instead of the shared one until the block exits.
+    Without a pool (backend failed to load) this does nothing.
+    """
+    if pool is None:
+        pool = get_tagger_pool(lang_code)
+    if pool is None:
+        yield None
+        return
+    with pool.checkout() as tagger:
+        previous = getattr(_BORROWED_TAGGERS, lang_code, None)
+        setattr(_BORROWED_TAGGERS, lang_code, tagger)
+        try:
+            yield tagger
+        finally:
+            setattr(_BORROWED_TAGGERS, lang_code, previous)
+
+def current_tagger(lang_code):
+    """The tagger this thread borrowed for lang_code, else the backend's shared one."""
+    tagger = getattr(_BORROWED_TAGGERS, lang_code, None)
+    if tagger is not None:
+        return tagger
+    return JAPANESE_TAGGER if lang_code == "JP" else ENGLISH_TAGGER
+
+
+# --- Instrumentation ---
+
+logger = get_logger(__name__)
+
+# Pipeline stages timed for every file, in pipeline order.
+PIPELINE_STAGES = ('decode', 'cache', 'parse', 'tag', 'serialize', 'zip', 'write')
+
+def new_file_metrics(filename, input_bytes=0):
+    """Returns an empty per-file metrics record (wall times in seconds)."""
+    metrics = {
+        "file": filename,
+        "input_bytes": input_bytes,
+        "output_bytes": 0,
+        "compressed_bytes": 0,
+        "segments": 0,
+        "tokens": 0,
+        "reused_segments": 0,
+        "repairs": 0,
+        "cache_hit": False,
+    }
+    for stage in PIPELINE_STAGES:
+        metrics[f"{stage}_seconds"] = 0.0
+    metrics["total_seconds"] = 0.0
+    return metrics
+
+@contextmanager
+def timed_stage(metrics, stage):
+    """Adds the wall time of the enclosed block to metrics['<stage>_seconds'] (no-op without metrics)."""
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics[f"{stage}_seconds"] += time.perf_counter() - start
+
+def log_file_metrics(metrics):
+    logger.info("Tagging metrics: %s", json.dumps(metrics, ensure_ascii=False))
+
+# Per-thread lists that collect_pipeline_warnings points pipeline_warning at
+_PIPELINE_WARNINGS = threading.local()
+
+def pipeline_warning(message):
+    """Shows a warning about an input file, or adds it to the thread's collect_pipeline_warnings list."""
+    messages = getattr(_PIPELINE_WARNINGS, 'messages', None)
+    if messages is None:
+        st.warning(message)
+    else:
+        messages.append(message)
+
+@contextmanager
+def collect_pipeline_warnings():
+    """
+    Collects the pipeline warnings of the calling thread in a list instead of
+    showing them; for background threads, which have no page to write to.
+    """
+    previous = getattr(_PIPELINE_WARNINGS, 'messages', None)
+    _PIPELINE_WARNINGS.messages = messages = []
+    try:
+        yield messages
+    finally:
+        _PIPELINE_WARNINGS.messages = previous
+
+def export_metrics_json(rows):
+    return json.dumps(rows, ensure_ascii=False, indent=2)
+
+def export_metrics_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]) if rows else [])
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
 
 
 # --- Core Processing Functions ---
 
 # --- JAPANESE PROCESSING ---
+# Column of the lemma in UniDic feature strings (column 0 is the coarse POS, pos1).
+UNIDIC_LEMMA_COLUMN = 7
+# Longest string handed to MeCab in one call. MeCab builds a lattice over its whole
+# input, so longer texts are parsed in pieces (see iter_japanese_pieces).
+JAPANESE_MECAB_MAX_CHARS = 1 << 16
+# A Japanese sentence ends at 。/！/？ (with any closing quotes or brackets) and the whitespace after it.
+JAPANESE_SENTENCE_END = re.compile(r'[。！？]+[」』）〕】〉》”’)]*\s*')
+
+def iter_japanese_pieces(text, max_chars=JAPANESE_MECAB_MAX_CHARS):
+    """
+    Yields text in pieces of at most max_chars characters, cut after the last
+    sentence end in each window, else after its last line break, else at
+    max_chars. Text no longer than max_chars is yielded as is.
+    """
+    start = 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        cut = None
+        for match in JAPANESE_SENTENCE_END.finditer(text, start, end):
+            cut = match.end()
+        if cut is None or cut == start:
+            cut = text.rfind('\n', start, end) + 1
+            if cut <= start:
+                cut = end
+        yield text[start:cut]
+        start = cut
+    yield text[start:] if start else text
+
+def iter_japanese_tokens(text):
+    """
+    Yields (token, pos, lemma) tuples for a Japanese text string.
+    Only pos1 and lemma are read, straight from each node's raw feature
+    string, instead of building fugashi's feature namedtuple per token.
+    Oversized text is parsed piece by piece, so MeCab's memory stays bounded.
+    """
+    load_language_backend("JP")
+    tagger = current_tagger("JP")
+    if tagger is None:
+        return
+    for piece in iter_japanese_pieces(text):
+        yield from _iter_japanese_piece_tokens(tagger, piece)
+
+def _iter_japanese_piece_tokens(tagger, text):
+    """iter_japanese_tokens for one piece of text (a single MeCab call)."""
+    for node in tagger.parseToNodeList(text):
+        token = node.surface
+        if not token:
+            continue
+        feature_raw = node.feature_raw
+        fields = feature_raw.split(',', UNIDIC_LEMMA_COLUMN + 1)
+        quote = feature_raw.find('"')
+        # A quoted field may contain commas. Quotes after the lemma column (accent
+        # data on particles, for instance) don't matter; otherwise parse like fugashi.
+        if quote != -1 and (len(fields) <= UNIDIC_LEMMA_COLUMN + 1
+                            or quote < len(feature_raw) - len(fields[-1])):
+            fields = next(csv.reader([feature_raw]))
+        # Unknown words carry no lemma column
+        lemma = fields[UNIDIC_LEMMA_COLUMN] if len(fields) > UNIDIC_LEMMA_COLUMN else None
+        yield token, fields[0], lemma or token
+
+def write_japanese_tokens(text, write):
+    """
+    Writes the tokens of a Japanese text string straight to an output buffer,
+    each as a newline-prefixed `token\tPOS\tlemma` line. Returns the token count.
+    """
+    count = 0
+    for token, pos, lemma in iter_japanese_tokens(text):
+        write(f"\n{token}\t{pos}\t{lemma}")
+        count += 1
+    return count
+
 def run_tagger_japanese(text):
     """Tokenizes and tags a single Japanese text string using Fugashi."""
-    if JAPANESE_TAGGER is None:
-        return []
-    nodes = JAPANESE_TAGGER.parseToNodeList(text)
+    # Output: token \t POS \t lemma
+    return [f"{token}\t{pos}\t{lemma}" for token, pos, lemma in iter_japanese_tokens(text)]
+
+def run_tagger_japanese_batch(texts):
+    """
+    Tags many Japanese text strings in one pass, returning one list of tagged
+    lines per input string. Identical strings (common in fragmented markup)
+    are sent to MeCab only once per batch.
+    """
+    tagged_by_text = {}
     results = []
-    for node in nodes:
-        if node.surface:
-            token = node.surface
-            pos = node.feature.pos1
-            lemma = node.feature.lemma if node.feature.lemma else token
-            # Output: token \t POS \t lemma
-            results.append(f"{token}\t{pos}\t{lemma}")
+    for text in texts:
+        tagged_lines = tagged_by_text.get(text)
+        if tagged_lines is None:
+            tagged_lines = tagged_by_text[text] = run_tagger_japanese(text)
+        results.append(tagged_lines)
     return results
 
 # --- ENGLISH PROCESSING ---
+
+# TextBlob's .tags drops every token whose tag starts with punctuation ('.', ',', '``', '$', ...).
+ENGLISH_PUNCTUATION_TAG = re.compile(f"[{re.escape(string.punctuation)}]")
+
+# Tokens scored per NumPy block (bounds the tokens x classes score matrix).
+PERCEPTRON_SCORE_BLOCK = 8192
+# Per-word feature rows are cached; the cache is dropped when it grows past this.
+PERCEPTRON_WORD_CACHE_MAX = 200_000
+
+class VectorizedPerceptronTagger:
+    """
+    Inference-only replacement for NLTK's PerceptronTagger that gives the same
+    tags. The feature -> class weights (a dict of dicts in NLTK) are compiled
+    into one dense NumPy matrix with a feature-string -> row index, and all
+    tokens of a batch are scored together.
+
+    Greedy decoding feeds each tag into the next token's features, so tags are
+    solved by fixed-point iteration: every token is scored with the current
+    guess for its two previous tags, and only tokens whose previous tags have
+    changed are scored again. The fixed point is exactly the left-to-right
+    greedy result. Weights are summed in NLTK's feature order and ties go to
+    the alphabetically last class, as in AveragedPerceptron.predict.
+    """
+
+    START = ("-START-", "-START2-")
+    END = ("-END-", "-END2-")
+
+    def __init__(self, weights, tagdict, classes):
+        import numpy as np
+
+        self.np = np
+        self.tagdict = tagdict
+        self.classes = sorted(classes)
+        class_index = {label: i for i, label in enumerate(self.classes)}
+        # Row 0 stays zero and stands in for features the model has never seen.
+        self.feature_index = {feature: row for row, feature in enumerate(weights, start=1)}
+        self.weights = np.zeros((len(weights) + 1, len(self.classes)))
+        for feature, row in self.feature_index.items():
+            for label, weight in weights[feature].items():
+                if label in class_index:
+                    self.weights[row, class_index[label]] = weight
+        self.bias_row = self.feature_index.get("bias", 0)
+        self._token_rows = {}
+        self._context_rows = {}
+
+    @classmethod
+    def from_nltk(cls, tagger):
+        """Compiles a loaded nltk.tag.perceptron.PerceptronTagger."""
+        return cls(tagger.model.weights, tagger.tagdict, tagger.classes)
+
+    def copy(self):
+        """Returns a tagger sharing this one's (read-only) weights, with its own feature row caches."""
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone._token_rows = {}
+        clone._context_rows = {}
+        return clone
+
+    @staticmethod
+    def normalize(word):
+        """Same as PerceptronTagger.normalize."""
+        if "-" in word and word[0] != "-":
+            return "!HYPHEN"
+        if word.isdigit() and len(word) == 4:
+            return "!YEAR"
+        if word and word[0].isdigit():
+            return "!DIGITS"
+        return word.lower()
+
+    def _cached_rows(self, cache, key, features):
+        rows = cache.get(key)
+        if rows is None:
+            if len(cache) >= PERCEPTRON_WORD_CACHE_MAX:
+                cache.clear()
+            get = self.feature_index.get
+            rows = cache[key] = tuple(get(feature, 0) for feature in features)
+        return rows
+
+    def _word_rows(self, word):
+        """Rows of the 'i suffix' and 'i pref1' features of a raw token."""
+        return self._cached_rows(self._token_rows, word, (
+            f"i suffix {word[-3:]}", f"i pref1 {word[0] if word else ''}"))
+
+    def _neighbour_rows(self, context_word):
+        """Rows of every feature built from a normalized context word."""
+        suffix = context_word[-3:]
+        return self._cached_rows(self._context_rows, context_word, (
+            f"i word {context_word}", f"i-1 word {context_word}", f"i-1 suffix {suffix}",
+            f"i-2 word {context_word}", f"i+1 word {context_word}", f"i+1 suffix {suffix}",
+            f"i+2 word {context_word}"))
+
+    def _previous_tags(self, tags, offsets, j):
+        """(prev, prev2) for token j; a tag that is not solved yet is guessed as ''."""
+        if offsets[j] == 0:
+            return self.START
+        if offsets[j] == 1:
+            return tags[j - 1] or "", self.START[0]
+        return tags[j - 1] or "", tags[j - 2] or ""
+
+    def _predict(self, rows):
+        """Best class index for each row of feature rows, in NLTK's summation order."""
+        np = self.np
+        rows = np.array(rows, dtype=np.intp)
+        best = np.empty(len(rows), dtype=np.intp)
+        last = len(self.classes) - 1
+        for start in range(0, len(rows), PERCEPTRON_SCORE_BLOCK):
+            block = rows[start:start + PERCEPTRON_SCORE_BLOCK]
+            scores = self.weights[block[:, 0]]
+            for slot in range(1, block.shape[1]):
+                scores += self.weights[block[:, slot]]
+            best[start:start + len(block)] = last - np.argmax(scores[:, ::-1], axis=1)
+        return best.tolist()
+
+    def tag_sents(self, sentences):
+        """Tags a list of token lists; returns a list of [(token, tag), ...] per sentence."""
+        tokens, offsets, words, static_rows, tags = [], [], [], [], []
+        for sentence in sentences:
+            context = list(self.START) + [self.normalize(w) for w in sentence] + list(self.END)
+            context_rows = [self._neighbour_rows(w) for w in context]
+            for i, word in enumerate(sentence):
+                suffix_row, pref1_row = self._word_rows(word)
+                tokens.append(word)
+                offsets.append(i)
+                words.append(context[i + 2])
+                static_rows.append((
+                    self.bias_row, suffix_row, pref1_row,
+                    context_rows[i + 2][0],
+                    context_rows[i + 1][1], context_rows[i + 1][2], context_rows[i][3],
+                    context_rows[i + 3][4], context_rows[i + 3][5], context_rows[i + 4][6],
+                ))
+                tags.append(self.tagdict.get(word) or None)
+
+        fixed = [tag is not None for tag in tags]
+        used = {}
+        todo = [j for j in range(len(tokens)) if not fixed[j]]
+        get = self.feature_index.get
+        while todo:
+            rows = []
+            for j in todo:
+                prev, prev2 = used[j] = self._previous_tags(tags, offsets, j)
+                bias, suffix, pref1, word, *neighbours = static_rows[j]
+                rows.append((
+                    bias, suffix, pref1,
+                    get(f"i-1 tag {prev}", 0), get(f"i-2 tag {prev2}", 0), get(f"i tag+i-2 tag {prev} {prev2}", 0),
+                    word, get(f"i-1 tag+i word {prev} {words[j]}", 0),
+                    *neighbours,
+                ))
+
+            changed = []
+            for j, best in zip(todo, self._predict(rows)):
+                tag = self.classes[best]
+                if tags[j] != tag:
+                    tags[j] = tag
+                    changed.append(j)
+
+            # Rescore the next two tokens of the same sentence if their inputs moved
+            todo = []
+            for j in changed:
+                for k in (j + 1, j + 2):
+                    if (k < len(tokens) and offsets[k] == offsets[j] + (k - j) and not fixed[k]
+                            and used.get(k) != self._previous_tags(tags, offsets, k)):
+                        todo.append(k)
+            todo = sorted(set(todo))
+
+        results, j = [], 0
+        for sentence in sentences:
+            results.append(list(zip(sentence, tags[j:j + len(sentence)])))
+            j += len(sentence)
+        return results
+
+# Penn Treebank tag prefixes of the open word classes, mapped to WordNet POS.
+PENN_TO_WORDNET_POS = {"NN": "n", "VB": "v", "JJ": "a", "RB": "r"}
+
+def lemmatize_english(token, pos_tag):
+    """
+    Lemma of a tagged token: the WordNet lemma (lowercased) for common nouns,
+    verbs, adjectives and adverbs; the token itself for proper nouns, closed
+    word classes, or when no lemma table is loaded.
+    """
+    pos = PENN_TO_WORDNET_POS.get(pos_tag[:2])
+    if ENGLISH_LEMMAS is None or pos is None or pos_tag.startswith("NNP"):
+        return token
+    form = token.lower()
+    return ENGLISH_LEMMAS[pos].get(form, form)
+
+def run_tagger_english_batch(texts):
+    """
+    Tags many English text strings with one pass of the pre-loaded perceptron
+    tagger and returns one list of 'token\tPOS\tlemma' lines per input text.
+
+    Tokenization and punctuation filtering follow TextBlob(text).tags exactly
+    (Punkt sentences, Treebank words, one tagging context per sentence), but
+    the model is loaded once per process instead of on every call, and all
+    sentences of the batch go through the tagger together.
+    """
+    load_language_backend("EN")
+    tagger = current_tagger("EN")
+    if tagger is None:
+        return [[] for _ in texts]
+    from nltk.tokenize import sent_tokenize, word_tokenize
+
+    unique_texts = list(dict.fromkeys(texts))
+    sentences = []
+    sentence_counts = []
+    for text in unique_texts:
+        text_sentences = [word_tokenize(sentence) for sentence in sent_tokenize(text)]
+        sentences.extend(text_sentences)
+        sentence_counts.append(len(text_sentences))
+
+    tagged_sentences = iter(tagger.tag_sents(sentences))
+    tagged_by_text = {}
+    for text, count in zip(unique_texts, sentence_counts):
+        results = []
+        for _ in range(count):
+            for token, pos_tag in next(tagged_sentences):
+                if ENGLISH_PUNCTUATION_TAG.match(pos_tag):
+                    continue
+                # Output: token \t POS \t lemma
+                results.append(f"{token}\t{pos_tag}\t{lemmatize_english(token, pos_tag)}")
+        tagged_by_text[text] = results
+    return [tagged_by_text[text] for text in texts]
+
 def run_tagger_english(text):
-    """Tokenizes and tags a single English text string using TextBlob."""
-    if not ENGLISH_TAGGER_READY:
-        return []
-        
-    blob = TextBlob(text)
-    results = []
-    for token, pos_tag in blob.tags:
-        # Use token as lemma for deployment stability
-        lemma = token 
-        # Output: token \t POS \t lemma
-        results.append(f"{token}\t{pos_tag}\t{lemma}")
+    """Tokenizes and tags a single English text string (same output as TextBlob(text).tags)."""
+    return run_tagger_english_batch([text])[0]
+
+# --- SEGMENT MEMOIZATION ---
+# Limits for the in-process memo of tagged segments.
+SEGMENT_MEMO_MAX_ENTRIES = 200_000
+SEGMENT_MEMO_MAX_CHARS = 64 << 20
+# Longer segments are rarely repeated verbatim, so they are not memoized.
+SEGMENT_MEMO_MAX_SEGMENT_CHARS = 2_000
+
+class SegmentMemo:
+    """
+    In-process LRU memo of tagged text segments, bounded by entry count and
+    by the characters held (segment text plus tagged lines). Keeps hit/miss
+    counters so repeated boilerplate can be seen being reused.
+    """
+
+    def __init__(self, max_entries, max_chars, max_segment_chars):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.max_segment_chars = max_segment_chars
+        self.entries = OrderedDict()  # (tagger_function, text) -> (tagged_lines, size)
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Streamlit sessions share this process
+
+    def get(self, tagger_function, text):
+        """Returns the memoized tagged lines for text, or None."""
+        key = (tagger_function, text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, tagger_function, text, tagged_lines):
+        if len(text) > self.max_segment_chars:
+            return
+        key = (tagger_function, text)
+        size = len(text) + sum(len(line) for line in tagged_lines)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.chars -= previous[1]
+            self.entries[key] = (tagged_lines, size)
+            self.chars += size
+            while len(self.entries) > self.max_entries or self.chars > self.max_chars:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.chars -= evicted_size
+
+    def stats(self):
+        """Returns the current counters as a dict."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "chars": self.chars}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+            self.hits = 0
+            self.misses = 0
+
+SEGMENT_MEMO = SegmentMemo(SEGMENT_MEMO_MAX_ENTRIES, SEGMENT_MEMO_MAX_CHARS, SEGMENT_MEMO_MAX_SEGMENT_CHARS)
+
+def tag_segments(texts, tagger_function, workers=1):
+    """
+    Tags a list of text segments, returning one list of tagged lines per segment.
+    Segments already in SEGMENT_MEMO are reused; the rest are tagged with the
+    batched variant of the tagger when one exists. With workers > 1, segments
+    of PARALLEL_TEXT_MIN_CHARS or more are split at sentence boundaries and
+    tagged across that many processes (see tag_text_parallel).
+    """
+    results = [None] * len(texts)
+    missing = []
+    lang_code = LANGUAGE_OF_TAGGER.get(tagger_function) if workers > 1 else None
+    for i, text in enumerate(texts):
+        if lang_code is not None and len(text) >= PARALLEL_TEXT_MIN_CHARS:
+            results[i] = tag_text_parallel(text, lang_code, workers)
+            continue
+        tagged_lines = SEGMENT_MEMO.get(tagger_function, text)
+        if tagged_lines is None:
+            missing.append(i)
+        else:
+            results[i] = tagged_lines
+    if not missing:
+        return results
+
+    missing_texts = [texts[i] for i in missing]
+    batch_function = BATCH_TAGGER_FUNCTIONS.get(tagger_function)
+    if batch_function is not None:
+        tagged = batch_function(missing_texts)
+    else:
+        tagged = [tagger_function(text) for text in missing_texts]
+    # A built-in tagger whose backend failed to load tags nothing; don't remember that
+    lang_code = LANGUAGE_OF_TAGGER.get(tagger_function)
+    memoize = lang_code is None or current_tagger(lang_code) is not None
+    for i, tagged_lines in zip(missing, tagged):
+        results[i] = tagged_lines
+        if memoize:
+            SEGMENT_MEMO.put(tagger_function, texts[i], tagged_lines)
     return results
 
-def process_xml_content(xml_string, lang_code, tagger_function):
+# --- Parallel Tagging of Large Texts ---
+# Texts at least this long are split and tagged in parallel when workers are available.
+PARALLEL_TEXT_MIN_CHARS = 4 << 20
+# Target size of each chunk handed to a worker.
+PARALLEL_CHUNK_CHARS = 1 << 18
+# How far around the target a chunk boundary is looked for.
+PARALLEL_SEARCH_CHARS = 1 << 16
+_PUNKT_TOKENIZER = None
+
+def find_japanese_chunk_boundary(text, target):
+    """
+    Offset of the sentence end nearest before target (or else after it),
+    or None if there is none within PARALLEL_SEARCH_CHARS.
+    """
+    start = max(0, target - PARALLEL_SEARCH_CHARS)
+    cut = None
+    for match in JAPANESE_SENTENCE_END.finditer(text, start, target):
+        cut = match.end()
+    if cut is None:
+        match = JAPANESE_SENTENCE_END.search(text, target, target + PARALLEL_SEARCH_CHARS)
+        cut = match.end() if match else None
+    return cut if cut is not None and 0 < cut < len(text) else None
+
+def find_english_chunk_boundary(text, target):
+    """
+    Offset of a Punkt sentence start near target, or None. Punkt decides each
+    boundary from the tokens around it, so a boundary found in a window of the
+    text (away from the window's edges) is one sent_tokenize finds in the
+    whole text; cutting there leaves every sentence, and so every tag, as is.
+    """
+    global _PUNKT_TOKENIZER
+    if _PUNKT_TOKENIZER is None:
+        from nltk.tokenize import PunktTokenizer
+        _PUNKT_TOKENIZER = PunktTokenizer("english")
+    start = max(0, target - PARALLEL_SEARCH_CHARS // 2)
+    window = text[start:target + PARALLEL_SEARCH_CHARS // 2]
+    # The first and last sentences may be cut off by the window
+    starts = [start + span[0] for span in _PUNKT_TOKENIZER.span_tokenize(window)][1:-1]
+    if not starts:
+        return None
+    return min(starts, key=lambda offset: abs(offset - target))
+
+CHUNK_BOUNDARY_FINDERS = {
+    "JP": find_japanese_chunk_boundary,
+    "EN": find_english_chunk_boundary,
+}
+
+def split_text_at_sentences(text, lang_code, chunk_chars=PARALLEL_CHUNK_CHARS):
+    """
+    Splits text into chunks of about chunk_chars characters, each ending at a
+    sentence boundary, so that tagging the chunks one by one gives the same
+    tokens as tagging the whole text. The chunks concatenate back to text.
+    """
+    find_boundary = CHUNK_BOUNDARY_FINDERS[lang_code]
+    chunks = []
+    start = 0
+    while len(text) - start > chunk_chars:
+        target = start + chunk_chars
+        cut = find_boundary(text, target)
+        while (cut is None or cut <= start) and target + chunk_chars < len(text):
+            # No boundary near the target (one very long sentence): look further on
+            target += chunk_chars
+            cut = find_boundary(text, target)
+        if cut is None or cut <= start:
+            break
+        chunks.append(text[start:cut])
+        start = cut
+    chunks.append(text[start:])
+    return chunks
+
+def tagging_worker_pool(lang_code, max_workers):
+    """
+    Process pool whose workers each load their own tagger for lang_code.
+    Workers are started with forkserver (spawn where unavailable) rather than
+    fork: a child forked from a job thread would inherit any lock another
+    thread held at that moment, such as SEGMENT_MEMO's or a logging lock, and
+    could hang on it. Tasks must be functions of tagging_worker.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=tagging_worker.init_worker,
+        initargs=(lang_code,)
+    )
+
+def tag_text_parallel(text, lang_code, workers, chunk_chars=PARALLEL_CHUNK_CHARS):
+    """
+    Tags one large text with the built-in tagger for lang_code across worker
+    processes: the text is split at sentence boundaries, the chunks are
+    tagged in parallel and their tagged lines joined in order. The result is
+    the same as TAGGER_FUNCTIONS[lang_code](text).
+    """
+    load_language_backend(lang_code)
+    chunks = split_text_at_sentences(text, lang_code, chunk_chars)
+    tagger_function = TAGGER_FUNCTIONS[lang_code]
+    if len(chunks) == 1:
+        return tagger_function(text)
+    tagged_lines = []
+    with tagging_worker_pool(lang_code, min(workers, len(chunks))) as executor:
+        for chunk_lines in executor.map(functools.partial(tagging_worker.tag_text, lang_code), chunks):
+            tagged_lines.extend(chunk_lines)
+    return tagged_lines
+
+# --- XML Backends ---
+# Parser used by process_xml_content: "lxml" (libxml2, when installed) or "stdlib" (xml.etree.ElementTree).
+XML_BACKEND = os.environ.get("TAGGER_XML_BACKEND", "lxml")
+# Bytes handed to the parser per feed() call by process_xml_bytes.
+XML_FEED_CHUNK_SIZE = 1 << 20
+# A leading XML declaration (optionally after a UTF-8 byte order mark) in raw file bytes.
+XML_DECLARATION_BYTES_PATTERN = re.compile(rb'^(?:\xef\xbb\xbf)?\s*<\?xml[^>]*\?>', re.IGNORECASE)
+XML_DECLARATION_ANYWHERE_BYTES_PATTERN = re.compile(rb'<\?xml[^>]*\?>', re.IGNORECASE)
+XML_DECLARATION_ANYWHERE_PATTERN = re.compile(r'<\?xml[^>]*\?>', re.IGNORECASE)
+# Prefixes ElementTree gives well-known namespace URIs (its default register_namespace table)
+KNOWN_NAMESPACE_PREFIXES = {
+    "http://www.w3.org/XML/1998/namespace": "xml",
+    "http://www.w3.org/1999/xhtml": "html",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#": "rdf",
+    "http://schemas.xmlsoap.org/wsdl/": "wsdl",
+    "http://www.w3.org/2001/XMLSchema": "xs",
+    "http://www.w3.org/2001/XMLSchema-instance": "xsi",
+    "http://purl.org/dc/elements/1.1/": "dc",
+}
+
+def escape_xml_text(text):
+    """Escapes &, < and > in character data, skipping the replace calls a string does not need."""
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+def escape_xml_attribute(text):
+    """escape_xml_text for attribute values, which also escapes quotes and CR/LF/tab (see ATTRIBUTE_ENTITIES)."""
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\r" in text:
+        text = text.replace("\r", "&#13;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    if "\t" in text:
+        text = text.replace("\t", "&#09;")
+    return text
+
+def collect_qnames(element):
+    """
+    Serialized names for every tag and attribute name under element, as
+    ElementTree's serializer computes them: returns (qnames, namespaces),
+    where qnames maps '{uri}local' names to 'prefix:local' and namespaces
+    maps each URI in use to its prefix (known ones, then ns0, ns1, ...).
+    """
+    qnames = {None: None}
+    namespaces = {}
+
+    def add_qname(qname):
+        if qname[:1] != "{":
+            qnames[qname] = qname
+            return
+        uri, local = qname[1:].rsplit("}", 1)
+        prefix = namespaces.get(uri)
+        if prefix is None:
+            prefix = KNOWN_NAMESPACE_PREFIXES.get(uri) or "ns%d" % len(namespaces)
+            if prefix != "xml":
+                namespaces[uri] = prefix
+        qnames[qname] = f"{prefix}:{local}"
+
+    for elem in element.iter():  # iter() walks the tree without recursing
+        tag = elem.tag
+        if isinstance(tag, ET.QName):
+            tag = tag.text
+        if isinstance(tag, str) and tag not in qnames:
+            add_qname(tag)
+        for key, value in elem.items():
+            if isinstance(key, ET.QName):
+                key = key.text
+            if key not in qnames:
+                add_qname(key)
+            if isinstance(value, ET.QName) and value.text not in qnames:
+                add_qname(value.text)
+    return qnames, namespaces
+
+def serialize_element(element):
+    """
+    Same string as ET.tostring(element, encoding='unicode'), built with an
+    explicit stack: ElementTree's own serializer recurses once per level and
+    fails on documents nested deeper than the recursion limit.
+    """
+    qnames, namespaces = collect_qnames(element)
+    escape_cdata, escape_attrib = escape_xml_text, escape_xml_attribute
+    pieces = []
+    write = pieces.append
+    # Elements still to be written, or markup strings (closing tags, tails) written when popped
+    stack = [element]
+    while stack:
+        elem = stack.pop()
+        if isinstance(elem, str):
+            write(elem)
+            continue
+        tag = elem.tag
+        text = elem.text
+        closing = None
+        if tag is ET.Comment:
+            write("<!--%s-->" % text)
+        elif tag is ET.ProcessingInstruction:
+            write("<?%s?>" % text)
+        else:
+            tag = qnames[tag]
+            if tag is None:
+                if text:
+                    write(escape_cdata(text))
+                closing = ""
+            else:
+                write("<" + tag)
+                if elem is element:
+                    for v, k in sorted(namespaces.items(), key=lambda x: x[1]):  # sort on prefix
+                        write(" xmlns%s=\"%s\"" % (":" + k if k else k, escape_attrib(v)))
+                for k, v in elem.items():
+                    if isinstance(k, ET.QName):
+                        k = k.text
+                    v = qnames[v.text] if isinstance(v, ET.QName) else escape_attrib(v)
+                    write(" %s=\"%s\"" % (qnames[k], v))
+                if text or len(elem):
+                    write(">")
+                    if text:
+                        write(escape_cdata(text))
+                    closing = "</" + tag + ">"
+                else:
+                    write(" />")
+        tail = escape_cdata(elem.tail) if elem.tail else ""
+        if closing is None:
+            write(tail)
+        else:
+            stack.append(closing + tail)
+            stack.extend(reversed(elem))
+    return "".join(pieces)
+
+
+class StdlibXMLBackend:
+    """xml.etree.ElementTree parsing, with an iterative serializer (see serialize_element)."""
+
+    name = "stdlib"
+    ParseError = ET.ParseError
+
+    def fromstring(self, text):
+        return ET.fromstring(text)
+
+    def tostring(self, root):
+        return serialize_element(root)
+
+    def parse_wrapped(self, data, start=0):
+        """Parses data[start:] (UTF-8 bytes) inside a TEMP_WRAPPER root, feeding it in slices."""
+        parser = ET.XMLParser(encoding='utf-8')
+        parser.feed(b'<TEMP_WRAPPER>')
+        view = memoryview(data)
+        for offset in range(start, len(data), XML_FEED_CHUNK_SIZE):
+            parser.feed(view[offset:offset + XML_FEED_CHUNK_SIZE])
+        parser.feed(b'</TEMP_WRAPPER>')
+        return parser.close()
+
+    def tobytes(self, element):
+        """UTF-8 serialization of element and its tail, without an XML declaration."""
+        return serialize_element(element).encode('utf-8')
+
+    def is_depth_limit_error(self, error):
+        return False
+
+    def parse_or_fallback(self, parse, *args):
+        """Calls the parse method named parse (fromstring or parse_wrapped); returns (root, self)."""
+        return getattr(self, parse)(*args), self
+
+
+class LxmlXMLBackend:
+    """
+    lxml (libxml2) parsing and serialization, with the ElementTree API the
+    rest of the pipeline uses. Comments and processing instructions are
+    dropped while parsing, as ElementTree.fromstring does, so .text/.tail hold
+    the same strings. Namespace prefixes are kept instead of becoming ns0.
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        from lxml import etree
+        self.etree = etree
+        # parse_or_fallback may hand a document to ElementTree, so its errors count too
+        self.ParseError = (etree.XMLSyntaxError, ET.ParseError)
+        self._local = threading.local()  # lxml parsers must not be shared between threads
+
+    def _parser(self):
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            parser = self._local.parser = self.etree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+        return parser
+
+    def fromstring(self, text):
+        return self.etree.fromstring(text.encode('utf-8'), self._parser())
+
+    def tostring(self, root):
+        return self.etree.tostring(root, encoding='unicode')
+
+    def parse_wrapped(self, data, start=0):
+        """Parses data[start:] (UTF-8 bytes) inside a TEMP_WRAPPER root, feeding it in slices."""
+        parser = self._parser()
+        parser.feed(b'<TEMP_WRAPPER>')
+        view = memoryview(data)
+        for offset in range(start, len(data), XML_FEED_CHUNK_SIZE):
+            parser.feed(bytes(view[offset:offset + XML_FEED_CHUNK_SIZE]))  # lxml only takes bytes/str
+        parser.feed(b'</TEMP_WRAPPER>')
+        return parser.close()
+
+    def tobytes(self, element):
+        """UTF-8 serialization of element and its tail, without an XML declaration."""
+        return self.etree.tostring(element, encoding='utf-8')
+
+    def is_depth_limit_error(self, error):
+        """True if error is libxml2 refusing to nest deeper than 2048 levels, not a fault in the document."""
+        return "Excessive depth in document" in str(error)
+
+    def parse_or_fallback(self, parse, *args):
+        """
+        Calls the parse method named parse (fromstring or parse_wrapped) and
+        returns (root, backend that built it). libxml2 refuses documents nested
+        deeper than 2048 levels; ElementTree has no such limit, so those are
+        parsed again with the stdlib backend.
+        """
+        try:
+            return getattr(self, parse)(*args), self
+        except self.etree.XMLSyntaxError as e:
+            if not self.is_depth_limit_error(e):
+                raise
+        return get_xml_backend("stdlib").parse_or_fallback(parse, *args)
+
+
+XML_BACKEND_CLASSES = {"lxml": LxmlXMLBackend, "stdlib": StdlibXMLBackend}
+_XML_BACKENDS = {}
+
+def get_xml_backend(name=None):
+    """Returns the XML backend called name (default XML_BACKEND), using the stdlib if lxml is missing."""
+    name = name or XML_BACKEND
+    backend = _XML_BACKENDS.get(name)
+    if backend is None:
+        try:
+            backend = XML_BACKEND_CLASSES[name]()
+        except ImportError:
+            logger.info("lxml is not installed; parsing XML with xml.etree.ElementTree")
+            backend = StdlibXMLBackend()
+        _XML_BACKENDS[name] = backend
+    return backend
+
+def element_paths(root):
+    """
+    Maps every element under root to a simple XPath-like path such as
+    'TEI/text/body/p[2]' (the wrapper root itself maps to '').
+    """
+    paths = {root: ''}
+    stack = [root]
+    while stack:
+        parent = stack.pop()
+        counts = {}
+        for child in parent:
+            counts[child.tag] = counts.get(child.tag, 0) + 1
+            prefix = paths[parent] + '/' if paths[parent] else ''
+            paths[child] = f"{prefix}{child.tag}[{counts[child.tag]}]"
+            stack.append(child)
+    return paths
+
+def collect_token_rows(token_rows, segment, path, text, tagged_lines):
+    """
+    Appends (segment, path, token, pos, lemma, start, end) rows for one tagged
+    text segment. start/end are character offsets of the token within the
+    segment text, or -1 when the tagger normalised the token.
+    """
+    cursor = 0
+    for line in tagged_lines:
+        token, pos, lemma = line.split('\t', 2)
+        start = text.find(token, cursor)
+        if start == -1:
+            end = -1
+        else:
+            end = cursor = start + len(token)
+        token_rows.append((segment, path, token, pos, lemma, start, end))
+
+# --- XML Repair ---
+# When input is not well-formed XML, repair common defects and parse it again
+# instead of tagging the whole file, markup included, as raw text ("0" disables).
+XML_RECOVER = os.environ.get("TAGGER_XML_RECOVER", "1") != "0"
+# A '<' or '&' this close to the end of a chunk may start markup completed by
+# the next chunk, so XMLRepairer.feed() holds it back until then; comments,
+# CDATA sections and processing instructions are waited for longer.
+XML_REPAIR_HOLD_CHARS = 1 << 16
+XML_REPAIR_HOLD_MARKUP_CHARS = 64 << 20
+
+XML_PREDEFINED_ENTITIES = frozenset(('amp', 'lt', 'gt', 'quot', 'apos'))
+XML_REPAIR_TOKEN = re.compile(r"""
+    (?P<comment><!--.*?-->)
+  | (?P<cdata><!\[CDATA\[.*?\]\]>)
+  | (?P<pi><\?(?P<target>[^\s?]*).*?\?>)
+  | (?P<doctype><!DOCTYPE[^\[>]*(?:\[.*?\])?\s*>)
+  | </(?P<end>[A-Za-z_][\w.:-]*)\s*>
+  | <(?P<start>[A-Za-z_][\w.:-]*)
+     (?P<attributes>(?:\s+[^\s"'<>/=]+\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'<>=`]+))*)\s*(?P<empty>/?)>
+  | &(?P<entity>\#[0-9]+|\#x[0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);
+  | (?P<stray>[<&])
+""", re.DOTALL | re.VERBOSE)
+XML_REPAIR_ATTRIBUTE = re.compile(r"""([^\s"'<>/=]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'<>=`]+))""")
+
+
+class XMLRepairer:
+    """
+    Rewrites text that is almost XML into well-formed XML, keeping the
+    markup that is valid:
+      - HTML named entities (&nbsp;, &eacute;) become the characters they
+        stand for; unknown entities and stray '&' are escaped
+      - a '<' that does not start markup is escaped
+      - unquoted attribute values are quoted
+      - elements left open are closed when an enclosing element ends (or at
+        the end of the input); end tags that close nothing are dropped
+      - DOCTYPE declarations and nested XML declarations are dropped
+    Input can be given in chunks (feed() then close()); repairs counts the
+    repairs made by kind.
+    """
+
+    def __init__(self):
+        self.open_elements = []
+        self.remainder = ''
+        self.repairs = {"entities": 0, "ampersands": 0, "brackets": 0, "attributes": 0,
+                        "unclosed_tags": 0, "stray_end_tags": 0, "declarations": 0}
+
+    @property
+    def repair_count(self):
+        return sum(self.repairs.values())
+
+    def summary(self):
+        """E.g. '3 repairs (2 entities, 1 unclosed_tags)'."""
+        details = ', '.join(f"{count} {kind}" for kind, count in self.repairs.items() if count)
+        return f"{self.repair_count} repairs ({details})" if details else "0 repairs"
+
+    def feed(self, text, final=False):
+        """Returns the repaired XML for the next chunk of input."""
+        text = self.remainder + text
+        self.remainder = ''
+        out = []
+        position = 0
+        for match in XML_REPAIR_TOKEN.finditer(text):
+            start = match.start()
+            if match.lastgroup == 'stray' and not final:
+                hold = XML_REPAIR_HOLD_MARKUP_CHARS if text.startswith(('<!', '<?'), start) else XML_REPAIR_HOLD_CHARS
+                if len(text) - start < hold:
+                    # Possibly markup that continues in the next chunk
+                    self.remainder = text[start:]
+                    out.append(text[position:start])
+                    return ''.join(out)
+            out.append(text[position:start])
+            out.append(self._repair_token(match))
+            position = match.end()
+        out.append(text[position:])
+        if final:
+            out.extend(self._close_open_elements(0))
+        return ''.join(out)
+
+    def close(self):
+        """Returns the repaired rest of the input, closing elements left open."""
+        return self.feed('', final=True)
+
+    def _repair_token(self, match):
+        kind = match.lastgroup
+        if kind == 'empty':  # a start tag
+            name, attributes, empty = match.group('start', 'attributes', 'empty')
+            if attributes:
+                attributes = XML_REPAIR_ATTRIBUTE.sub(self._repair_attribute, attributes)
+            if not empty:
+                self.open_elements.append(name)
+            return f"<{name}{attributes}{empty}>"
+        if kind == 'end':
+            name = match.group('end')
+            if self.open_elements and self.open_elements[-1] == name:
+                self.open_elements.pop()
+                return match.group()
+            if name not in self.open_elements:
+                self.repairs["stray_end_tags"] += 1
+                return ''
+            depth = len(self.open_elements) - 1 - self.open_elements[::-1].index(name)
+            closing = self._close_open_elements(depth + 1)
+            self.open_elements.pop()
+            closing.append(f"</{name}>")
+            return ''.join(closing)
+        if kind == 'entity':
+            return self._repair_entity(match.group('entity'))
+        if kind == 'stray':
+            if match.group() == '&':
+                self.repairs["ampersands"] += 1
+                return '&amp;'
+            self.repairs["brackets"] += 1
+            return '&lt;'
+        if kind == 'doctype' or (kind == 'pi' and match.group('target').lower() == 'xml'):
+            self.repairs["declarations"] += 1
+            return ''
+        return match.group()  # comments, CDATA sections, processing instructions
+
+    def _close_open_elements(self, depth):
+        """End tags for the open elements above depth, innermost first (counted as repairs)."""
+        closing = [f"</{name}>" for name in reversed(self.open_elements[depth:])]
+        self.repairs["unclosed_tags"] += len(closing)
+        del self.open_elements[depth:]
+        return closing
+
+    def _repair_entity(self, name):
+        if name.startswith('#'):
+            try:
+                code_point = int(name[2:], 16) if name[1] in 'xX' else int(name[1:])
+                if code_point in (0x9, 0xA, 0xD) or 0x20 <= code_point <= 0x10FFFF and \
+                        not 0xD800 <= code_point <= 0xDFFF and code_point not in (0xFFFE, 0xFFFF):
+                    return f"&{name};"
+            except ValueError:
+                pass
+        elif name in XML_PREDEFINED_ENTITIES:
+            return f"&{name};"
+        else:
+            character = html.entities.html5.get(f"{name};")
+            if character is not None:
+                self.repairs["entities"] += 1
+                return escape(character)
+        self.repairs["entities"] += 1
+        return f"&amp;{name};"
+
+    def _repair_attribute(self, match):
+        name, double_quoted, single_quoted, unquoted = match.groups()
+        if unquoted is not None:
+            self.repairs["attributes"] += 1
+            value = unquoted
+        else:
+            value = double_quoted if double_quoted is not None else single_quoted
+        value = XML_REPAIR_TOKEN.sub(self._repair_attribute_text, value)
+        return f'{name}="{value}"' if '"' not in value else f"{name}='{value}'"
+
+    def _repair_attribute_text(self, match):
+        if match.group('entity'):
+            return self._repair_entity(match.group('entity'))
+        if match.group().startswith('&'):
+            self.repairs["ampersands"] += 1
+            return '&amp;' + match.group()[1:]
+        self.repairs["brackets"] += 1
+        return '&lt;' + match.group()[1:]
+
+
+def repair_xml(text):
+    """Returns (repaired_text, XMLRepairer) for a whole document (see XMLRepairer)."""
+    repairer = XMLRepairer()
+    return repairer.feed(text, final=True), repairer
+
+
+# --- Element Selection ---
+
+def local_name(name):
+    """'{namespace}note' and 'tei:note' -> 'note'."""
+    return name.rpartition('}')[2].rpartition(':')[2]
+
+
+class ElementRule:
+    """
+    One include/exclude rule, matched against an element and its ancestors:
+      note                   an element name ('*' matches any element)
+      teiHeader/fileDesc     a child path; 'body//note' allows any depth between
+      /TEI/teiHeader         a path anchored at the top of the document
+      div[@type='meta']      attribute predicates: [@attr], [@attr='v'], [@attr!='v']
+      @type='meta'           shorthand for *[@type='meta']
+    Names are compared without namespace or prefix.
+    """
+
+    TOKEN = re.compile(r"\[[^\]]*\]|//|/|[^\[/]+")
+    PREDICATE = re.compile(r"""\[\s*@([^\s=!\]]+)\s*(?:(!?=)\s*(?:"([^"]*)"|'([^']*)'))?\s*\]$""")
+
+    def __init__(self, rule):
+        self.rule = rule.strip()
+        text = self.rule
+        if text.startswith('@'):
+            text = f"*[{text}]"
+        # Each step is (axis, name, predicates); axis relates the step to the previous
+        # one ('child'/'descendant'), or for the first step 'top' or 'any' (unanchored)
+        self.steps = []
+        axis = 'any'
+        if text.startswith('//'):
+            text = text[2:]
+        elif text.startswith('/'):
+            axis, text = 'top', text[1:]
+        tokens = self.TOKEN.findall(text)
+        if ''.join(tokens) != text:
+            raise ValueError(f"Invalid element rule: {rule!r}")
+        step = None
+        for token in tokens:
+            if token in ('/', '//'):
+                if step is None:
+                    raise ValueError(f"Invalid element rule: {rule!r}")
+                self.steps.append(step)
+                axis, step = ('child' if token == '/' else 'descendant'), None
+            elif token.startswith('['):
+                match = self.PREDICATE.match(token)
+                if step is None or not match:
+                    raise ValueError(f"Invalid element rule: {rule!r}")
+                attribute, operator, double_quoted, single_quoted = match.groups()
+                value = double_quoted if double_quoted is not None else single_quoted
+                step[2].append((local_name(attribute), operator, value))
+            elif step is None and token.strip():
+                step = (axis, local_name(token.strip()), [])
+            else:
+                raise ValueError(f"Invalid element rule: {rule!r}")
+        if step is None:
+            raise ValueError(f"Invalid element rule: {rule!r}")
+        self.steps.append(step)
+
+    def __repr__(self):
+        return f"ElementRule({self.rule!r})"
+
+    @staticmethod
+    def _step_matches(step, tag, attrib):
+        _, name, predicates = step
+        if name != '*' and local_name(tag) != name:
+            return False
+        for attribute, operator, value in predicates:
+            actual = attrib.get(attribute)
+            if actual is None:
+                actual = next((v for k, v in attrib.items() if local_name(k) == attribute), None)
+            if actual is None or (operator == '=' and actual != value) or (operator == '!=' and actual == value):
+                return False
+        return True
+
+    def advance(self, tag, attrib, parent_state):
+        """
+        Returns this rule's match state for an element, computed from its
+        parent's state (None for a top-level element): a pair of bit masks
+        (ended, reached), where bit k of ended is set if steps[0..k] match
+        with step k on this element, and bit k of reached if they match
+        with step k on this element or on one of its ancestors. So each
+        element costs one pass over the steps, however deep it is.
+        """
+        parent_ended, parent_reached = parent_state if parent_state is not None else (0, 0)
+        ended = 0
+        for index, step in enumerate(self.steps):
+            axis = step[0]
+            if axis == 'any':
+                possible = True
+            elif axis == 'top':
+                possible = parent_state is None
+            elif axis == 'child':
+                possible = parent_ended >> (index - 1) & 1
+            else:  # descendant
+                possible = parent_reached >> (index - 1) & 1
+            if possible and self._step_matches(step, tag, attrib):
+                ended |= 1 << index
+        return ended, parent_reached | ended
+
+    def matched(self, state):
+        """True if the element with match state state (see advance) matches the whole rule."""
+        return bool(state[0] >> (len(self.steps) - 1) & 1)
+
+
+class ElementSelection:
+    """
+    Include/exclude rules deciding which elements have their text tagged.
+    An excluded element's whole subtree (its text, children and their tails)
+    is copied through untouched; its own tail belongs to the parent and is
+    still tagged. With include rules, only text inside an included element
+    (and not inside an excluded one) is tagged; without, everything is.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = [rule if isinstance(rule, ElementRule) else ElementRule(rule) for rule in include]
+        self.exclude = [rule if isinstance(rule, ElementRule) else ElementRule(rule) for rule in exclude]
+
+    @classmethod
+    def from_text(cls, include='', exclude=''):
+        """
+        Builds a selection from comma- or newline-separated rule lists, or
+        returns None when both are empty. Raises ValueError on a bad rule.
+        """
+        def split(text):
+            return [rule.strip() for rule in re.findall(r"(?:\[[^\]]*\]|[^,\n\[])+", text or '') if rule.strip()]
+        include, exclude = split(include), split(exclude)
+        if not include and not exclude:
+            return None
+        return cls(include, exclude)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def signature(self):
+        """Canonical text of the rules, for cache keys."""
+        return "include=" + "|".join(rule.rule for rule in self.include) + \
+            ";exclude=" + "|".join(rule.rule for rule in self.exclude)
+
+    def state(self, tag, attrib, parent_state):
+        """
+        Returns the (tag_text, included, rule_states) state of an element,
+        given its parent's state (see root_state). rule_states holds each
+        rule's match state (see ElementRule.advance) for the children.
+        """
+        tag_text, included, parent_rule_states = parent_state
+        if not tag_text and included:
+            return parent_state  # inside an excluded subtree
+        rules = self.include + self.exclude
+        if parent_rule_states is None:
+            rule_states = tuple(rule.advance(tag, attrib, None) for rule in rules)
+        else:
+            rule_states = tuple(rule.advance(tag, attrib, rule_state)
+                                for rule, rule_state in zip(rules, parent_rule_states))
+        include_count = len(self.include)
+        if any(rule.matched(rule_state) for rule, rule_state in zip(self.exclude, rule_states[include_count:])):
+            return False, True, None
+        if not included:
+            included = any(rule.matched(rule_state) for rule, rule_state in zip(self.include, rule_states))
+        return included, included, rule_states
+
+    def root_state(self):
+        """State of the wrapper around the document: tagged unless there are include rules."""
+        return not self.include, not self.include, None
+
+
+def collect_text_segments(root, selection=None):
+    """
+    Returns every non-blank .text and .tail under root as (element, attribute)
+    pairs, in document order: an element's text, then its children, then its
+    tail. Uses an explicit stack, so nesting depth is unlimited.
+    With an ElementSelection, text the selection leaves out is skipped.
+    """
+    if selection:
+        return _collect_selected_text_segments(root, selection)
+    segments = []
+    # Elements still to visit, or (element, 'tail') pairs that are due once
+    # the element's subtree has been visited
+    stack = [root]
+    while stack:
+        element = stack.pop()
+        if type(element) is tuple:
+            segments.append(element)
+            continue
+        text = element.text
+        if text and text.strip():
+            segments.append((element, 'text'))
+        for child in reversed(element):
+            tail = child.tail
+            if tail and tail.strip():
+                stack.append((child, 'tail'))
+            stack.append(child)
+    return segments
+
+def _collect_selected_text_segments(root, selection):
+    """collect_text_segments with an ElementSelection (root being the wrapper)."""
+    segments = []
+    # (element, state) to visit, or (element, 'tail') pairs as above
+    stack = [(root, selection.root_state())]
+    while stack:
+        item = stack.pop()
+        if item[1] == 'tail':
+            segments.append(item)
+            continue
+        element, state = item
+        tag_text = state[0]
+        if tag_text:
+            text = element.text
+            if text and text.strip():
+                segments.append((element, 'text'))
+        elif state[1]:
+            continue  # excluded: nothing below is tagged, not even the children's tails
+        for child in reversed(element):
+            if tag_text:
+                tail = child.tail
+                if tail and tail.strip():
+                    stack.append((child, 'tail'))
+            stack.append((child, selection.state(child.tag, child.attrib, state)))
+    return segments
+
+def tag_tree(root, tagger_function, metrics=None, token_rows=None, selection=None, fingerprints=None, workers=1):
+    """
+    Tags every non-blank .text and .tail under root in place, replacing each
+    with its 'token\tPOS\tlemma' lines (steps 3-4 of process_xml_content).
+    With a SegmentFingerprints record, segments tagged in the previous run
+    are taken from it and only the changed ones are tagged. workers is
+    passed on to tag_segments.
+    """
+    # 3. Collect every taggable text segment, in document order
+    segments = collect_text_segments(root, selection)
+    paths = element_paths(root) if token_rows is not None or fingerprints is not None else None
+
+    # 4. Tag all segments together and write the results back into the tree
+    with timed_stage(metrics, 'tag'):
+        texts = [getattr(element, attr) for element, attr in segments]
+        if fingerprints is None:
+            tagged = tag_segments(texts, tagger_function, workers)
+        else:
+            keys = [fingerprints.key(paths[element], attr, text) for (element, attr), text in zip(segments, texts)]
+            tagged = [fingerprints.get(key) for key in keys]
+            changed = [i for i, tagged_lines in enumerate(tagged) if tagged_lines is None]
+            changed_texts = [texts[i] for i in changed]
+            for i, tagged_lines in zip(changed, tag_segments(changed_texts, tagger_function, workers)):
+                tagged[i] = tagged_lines
+            fingerprints.record(keys, tagged)
+            if metrics is not None:
+                metrics["reused_segments"] += len(segments) - len(changed)
+        for (element, attr), tagged_lines in zip(segments, tagged):
+            setattr(element, attr, '\n' + '\n'.join(tagged_lines) + '\n')
+    if metrics is not None:
+        metrics["segments"] += len(segments)
+        metrics["tokens"] += sum(len(tagged_lines) for tagged_lines in tagged)
+    if token_rows is not None:
+        for index, ((element, attr), text, tagged_lines) in enumerate(zip(segments, texts, tagged)):
+            # A tail belongs to the parent of the element it follows
+            path = paths[element] if attr == 'text' else paths[element].rpartition('/')[0]
+            collect_token_rows(token_rows, index, path, text, tagged_lines)
+
+def process_xml_content(xml_string, lang_code, tagger_function, metrics=None, token_rows=None, xml_backend=None,
+                        selection=None, fingerprints=None, workers=1):
     """
     Parses the XML string and tags ONLY the plain text content, 
     preserving all XML tags and attributes.
+    xml_backend names the parser to use (see get_xml_backend).
+    selection is an optional ElementSelection; text it leaves out is copied untagged.
+    fingerprints is an optional SegmentFingerprints record (see tag_tree).
+    With workers > 1, very large texts are tagged in parallel (see tag_segments).
+    If a metrics record is given, per-stage times and counts are added to it.
+    If a token_rows list is given, one row per token is appended to it
+    (see collect_token_rows).
     """
     
     # 1. CRITICAL FIX: Ensure the input XML is wrapped in a single root element
     temp_root_tag = 'TEMP_WRAPPER'
-    
-    # Remove any XML declaration and CDATA to avoid parser errors
-    cleaned_xml_string = re.sub(r'<\?xml[^>]*\?>', '', xml_string, flags=re.IGNORECASE).strip()
-    
-    wrapped_xml = f"<{temp_root_tag}>{cleaned_xml_string}</{temp_root_tag}>"
+    backend = get_xml_backend(xml_backend)
     
     try:
-        # 2. Parse the XML
-        root = ET.fromstring(wrapped_xml)
-        
-    except ET.ParseError as e:
-        # If standard parsing fails (malformed XML, or raw text), treat as plain text.
-        st.warning(f"Input failed XML parsing ({e}). Processing as raw text only.")
-        tagged_lines = tagger_function(xml_string)
-        return f'<text lang="{lang_code}">\n' + "\n".join(tagged_lines) + '\n</text>'
+        with timed_stage(metrics, 'parse'):
+            # Remove any XML declaration and CDATA to avoid parser errors
+            cleaned_xml_string = XML_DECLARATION_ANYWHERE_PATTERN.sub('', xml_string).strip()
+            
+            wrapped_xml = f"<{temp_root_tag}>{cleaned_xml_string}</{temp_root_tag}>"
+            
+            # 2. Parse the XML
+            root, backend = backend.parse_or_fallback('fromstring', wrapped_xml)
         
-    # 3. Function to traverse and modify the tree
-    def traverse_and_tag(element):
-        # 3a. Process the text content directly inside the current element (.text)
-        if element.text and element.text.strip():
-            tagged_lines = tagger_function(element.text)
-            element.text = '\n' + '\n'.join(tagged_lines) + '\n'
-
-        # 3b. Recursively process children
-        for child in element:
-            traverse_and_tag(child)
-
-        # 3c. Process the text content that comes after a child element (.tail)
-        if element.tail and element.tail.strip():
-            tagged_lines = tagger_function(element.tail)
-            element.tail = '\n' + '\n'.join(tagged_lines) + '\n'
-
-    # 4. Start traversal and modification
-    traverse_and_tag(root)
-    
+    except backend.ParseError as e:
+        return _process_malformed_xml(xml_string, e, lang_code, tagger_function, backend, metrics=metrics,
+                                      token_rows=token_rows, selection=selection, fingerprints=fingerprints,
+                                      workers=workers)
+
+    tag_tree(root, tagger_function, metrics=metrics, token_rows=token_rows, selection=selection,
+             fingerprints=fingerprints, workers=workers)
+    return _serialize_wrapped(root, backend, metrics)
+
+def _serialize_wrapped(root, backend, metrics=None):
+    """Serializes a tagged TEMP_WRAPPER root without the wrapper tags (end of process_xml_content)."""
     # 5. Reconstruct the XML string, removing the temporary root tag
-    full_xml = ET.tostring(root, encoding='unicode')
-    
-    full_xml = re.sub(r'^<TEMP_WRAPPER>', '', full_xml)
-    full_xml = re.sub(r'</TEMP_WRAPPER>$', '', full_xml).strip()
+    with timed_stage(metrics, 'serialize'):
+        full_xml = backend.tostring(root)
+        
+        full_xml = re.sub(r'^<TEMP_WRAPPER>', '', full_xml)
+        full_xml = re.sub(r'</TEMP_WRAPPER>$', '', full_xml).strip()
     
     return full_xml
 
-def process_text(text, lang_code, tagger_function):
-    """Primary function to process the entire input text, handling XML structure."""
-    return process_xml_content(text, lang_code, tagger_function)
+def _process_malformed_xml(xml_string, error, lang_code, tagger_function, backend, metrics=None, token_rows=None,
+                           selection=None, fingerprints=None, workers=1):
+    """
+    process_xml_content for a document the parser rejected with error: the
+    markup is repaired (see XMLRepairer) and parsed once more; if that fails
+    too, or repair is off, the whole input is tagged as raw text.
+    """
+    root = None
+    if XML_RECOVER:
+        # Repair entities, stray '<'/'&' and unclosed tags, keeping the valid markup
+        with timed_stage(metrics, 'parse'):
+            cleaned_xml_string = XML_DECLARATION_ANYWHERE_PATTERN.sub('', xml_string).strip()
+            repaired_xml, repairer = repair_xml(cleaned_xml_string)
+            wrapped_xml = f"<TEMP_WRAPPER>{repaired_xml}</TEMP_WRAPPER>"
+            try:
+                root, backend = backend.parse_or_fallback('fromstring', wrapped_xml)
+            except backend.ParseError:
+                pass
+    if root is None:
+        # If standard parsing fails (malformed XML, or raw text), treat as plain text.
+        pipeline_warning(f"Input failed XML parsing ({error}). Processing as raw text only.")
+        with timed_stage(metrics, 'tag'):
+            tagged_lines = tag_segments([xml_string], tagger_function, workers)[0]
+        if metrics is not None:
+            metrics["segments"] += 1
+            metrics["tokens"] += len(tagged_lines)
+        if token_rows is not None:
+            collect_token_rows(token_rows, 0, '', xml_string, tagged_lines)
+        return f'<text lang="{lang_code}">\n' + "\n".join(tagged_lines) + '\n</text>'
+    pipeline_warning(f"Input failed XML parsing ({error}). Made {repairer.summary()} and kept the markup.")
+    if metrics is not None:
+        metrics["repairs"] += repairer.repair_count
+
+    tag_tree(root, tagger_function, metrics=metrics, token_rows=token_rows, selection=selection,
+             fingerprints=fingerprints, workers=workers)
+    return _serialize_wrapped(root, backend, metrics)
+
+def serialize_children(root, backend):
+    """
+    UTF-8 serialization of everything inside root (its text, then each child
+    with its tail) without root's own tags, stripped at both ends like the
+    .strip() in process_xml_content.
+    """
+    children = list(root)
+    if children:
+        head = (root.text or '').lstrip()
+        if children[-1].tail:
+            children[-1].tail = children[-1].tail.rstrip()
+    else:
+        head = (root.text or '').strip()
+    pieces = [escape(head).encode('utf-8')] if head else []
+    pieces.extend(backend.tobytes(child) for child in children)
+    # A single top-level element (the usual case) is returned without another copy
+    return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+def process_xml_bytes(content_bytes, lang_code, tagger_function, metrics=None, token_rows=None, xml_backend=None,
+                      selection=None, fingerprints=None, workers=1):
+    """
+    Bytes-in/bytes-out version of process_xml_content for whole files. The
+    UTF-8 input is fed to the parser in slices inside a wrapper root, after
+    skipping a leading XML declaration, and each top-level node is serialized
+    straight to UTF-8, so the document is never decoded, regex-rewritten or
+    re-wrapped as one string. Returns process_xml_content's result, encoded.
+    Input the parser rejects goes through process_xml_content instead.
+    """
+    backend = get_xml_backend(xml_backend)
+    try:
+        with timed_stage(metrics, 'parse'):
+            declaration = XML_DECLARATION_BYTES_PATTERN.match(content_bytes)
+            if declaration:
+                start = declaration.end()
+            elif content_bytes.startswith(codecs.BOM_UTF8):
+                start = len(codecs.BOM_UTF8)
+            else:
+                start = 0
+            root, backend = backend.parse_or_fallback('parse_wrapped', content_bytes, start)
+    except backend.ParseError as e:
+        with timed_stage(metrics, 'decode'):
+            text = content_bytes.decode('utf-8')
+        if XML_DECLARATION_ANYWHERE_BYTES_PATTERN.search(content_bytes, start):
+            # The string path removes declarations further in before parsing
+            return process_xml_content(text, lang_code, tagger_function, metrics=metrics, token_rows=token_rows,
+                                       xml_backend=backend.name, selection=selection,
+                                       fingerprints=fingerprints, workers=workers).encode('utf-8')
+        # Otherwise it would parse exactly what was just rejected: repair it, or tag it as raw text
+        return _process_malformed_xml(text, e, lang_code, tagger_function, backend, metrics=metrics,
+                                      token_rows=token_rows, selection=selection, fingerprints=fingerprints,
+                                      workers=workers).encode('utf-8')
+
+    # The string path strips the document before wrapping it; strip the same text here
+    children = list(root)
+    if root.text:
+        root.text = root.text.lstrip() if children else root.text.strip()
+    if children and children[-1].tail:
+        children[-1].tail = children[-1].tail.rstrip()
+
+    tag_tree(root, tagger_function, metrics=metrics, token_rows=token_rows, selection=selection,
+             fingerprints=fingerprints, workers=workers)
+    with timed_stage(metrics, 'serialize'):
+        return serialize_children(root, backend)
+
+def process_bytes(content_bytes, lang_code, tagger_function, use_cache=True, metrics=None, token_rows=None,
+                  selection=None, document_id=None, workers=1):
+    """
+    Primary function to process a whole input file given as UTF-8 bytes,
+    handling XML structure; returns the tagged XML as UTF-8 bytes.
+    Results of the built-in taggers are looked up in and stored to RESULT_CACHE.
+    Collecting token_rows bypasses the cache, which keeps only the XML.
+    With a document_id (e.g. the file name) the document is re-tagged
+    incrementally: the segments of its previous run are kept in the cache
+    and only segments that changed since then are tagged.
+    With workers > 1, very large texts are tagged in parallel (see tag_segments).
+    """
+    cache = RESULT_CACHE if use_cache and TAGGER_FUNCTIONS.get(lang_code) is tagger_function else None
+    if cache is not None:
+        # Load before building the key, which records the loaded lemma table, and
+        # never cache the empty output of a backend that failed to load.
+        load_language_backend(lang_code)
+        if current_tagger(lang_code) is None:
+            cache = None
+    if cache is None:
+        return process_xml_bytes(content_bytes, lang_code, tagger_function, metrics=metrics, token_rows=token_rows,
+                                 selection=selection, workers=workers)
+
+    options = selection.signature() if selection else ''
+    key = None
+    if token_rows is None:
+        with timed_stage(metrics, 'cache'):
+            key = cache.make_key(content_bytes, lang_code, options)
+            processed_xml = cache.get(key)
+        if processed_xml is not None:
+            if metrics is not None:
+                metrics["cache_hit"] = True
+            return processed_xml
+
+    fingerprints = None
+    if document_id is not None:
+        with timed_stage(metrics, 'cache'):
+            segments_key = cache.make_key(document_id.encode('utf-8'), lang_code, f"segments;{options}")
+            fingerprints = cache.get_segments(segments_key)
+    processed_xml = process_xml_bytes(content_bytes, lang_code, tagger_function, metrics=metrics,
+                                      token_rows=token_rows, selection=selection, fingerprints=fingerprints,
+                                      workers=workers)
+    with timed_stage(metrics, 'cache'):
+        if fingerprints is not None:
+            cache.put_segments(segments_key, fingerprints)
+        if key is not None:
+            cache.put(key, processed_xml)
+    return processed_xml
+
+def process_text(text, lang_code, tagger_function, use_cache=True, metrics=None, token_rows=None, selection=None,
+                 document_id=None, workers=1):
+    """String version of process_bytes."""
+    return process_bytes(text.encode('utf-8'), lang_code, tagger_function, use_cache=use_cache, metrics=metrics,
+                         token_rows=token_rows, selection=selection, document_id=document_id,
+                         workers=workers).decode('utf-8')
+
+def process_file_bytes(filename, content_bytes, lang_code, tagger_function, use_cache=True, token_rows=None,
+                       selection=None, incremental=False, workers=1):
+    """
+    Processes one uploaded/read file without decoding it.
+    Returns (processed_xml, metrics), processed_xml being UTF-8 bytes.
+    With incremental=True, only the parts changed since the last run of the
+    same filename are tagged (see process_bytes). With workers > 1, very
+    large texts are tagged in parallel.
+    """
+    metrics = new_file_metrics(filename, len(content_bytes))
+    start = time.perf_counter()
+    processed_xml = process_bytes(content_bytes, lang_code, tagger_function, use_cache=use_cache, metrics=metrics,
+                                  token_rows=token_rows, selection=selection,
+                                  document_id=filename if incremental else None, workers=workers)
+    metrics["total_seconds"] = time.perf_counter() - start
+    return processed_xml, metrics
+
+# Language codes mapped to their tagger functions (used by the CLI and worker processes).
+TAGGER_FUNCTIONS = {
+    "JP": run_tagger_japanese,
+    "EN": run_tagger_english,
+}
+
+# Tagger functions mapped to their language code.
+LANGUAGE_OF_TAGGER = {tagger_function: lang_code for lang_code, tagger_function in TAGGER_FUNCTIONS.items()}
+
+# Tagger functions mapped to a variant that tags many segments in one call.
+BATCH_TAGGER_FUNCTIONS = {
+    run_tagger_japanese: run_tagger_japanese_batch,
+    run_tagger_english: run_tagger_english_batch,
+}
+
+# Tagger functions mapped to a variant that writes tokens straight to an output buffer.
+TOKEN_WRITERS = {
+    run_tagger_japanese: write_japanese_tokens,
+}
+
+
+# --- Result Cache ---
+
+# Bump when the output format changes, or when entries written so far cannot be
+# trusted (v4: v3 could hold the empty output of a backend that failed to load),
+# so that older cached results are ignored.
+RESULT_CACHE_FORMAT_VERSION = 4
+# File name suffix of the stored segment fingerprints of a document.
+SEGMENTS_SUFFIX = '.segments.json.gz'
+# Packages whose versions decide the output of each language backend.
+TAGGER_PACKAGES = {
+    "JP": ("fugashi", "unidic-lite"),
+    "EN": ("textblob", "nltk"),
+}
+
+def get_tagger_version(lang_code):
+    """Returns a string identifying the tagger and dictionary versions used for lang_code."""
+    versions = []
+    for package in TAGGER_PACKAGES.get(lang_code, ()):
+        try:
+            versions.append(f"{package}=={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}==unknown")
+    if lang_code == "EN":
+        # Without a loaded table the tokens are their own lemmas, whatever is on disk
+        lemmas = read_english_lemma_table_version() if ENGLISH_LEMMAS is not None else None
+        versions.append(f"lemmas={lemmas}")
+    versions.append(f"xml={get_xml_backend().name}")
+    versions.append(f"recover={int(XML_RECOVER)}")
+    return f"v{RESULT_CACHE_FORMAT_VERSION};" + ";".join(versions)
+
+
+class SegmentFingerprints:
+    """
+    The tagged segments of one document's previous run, keyed by fingerprint
+    (element path, 'text' or 'tail', and a hash of the segment text), plus
+    the segments of the current run as they are recorded. A segment whose
+    path changed (e.g. after a paragraph was inserted before it) is still
+    found by its text hash, since tagging depends on the text alone.
+    """
+
+    def __init__(self, previous=None):
+        # fingerprint -> tagged lines joined by '\n' (one string per segment is much
+        # cheaper to store and load than a list per segment)
+        self.previous = previous or {}
+        self.by_digest = {key.rpartition('\0')[2]: block for key, block in self.previous.items()}
+        self.current = {}
+
+    @staticmethod
+    def key(path, attr, text):
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+        return f"{path}\0{attr}\0{digest}"
+
+    def get(self, key):
+        """Returns the previous run's tagged lines for a segment fingerprint, or None."""
+        block = self.previous.get(key)
+        if block is None:
+            block = self.by_digest.get(key.rpartition('\0')[2])
+            if block is None:
+                return None
+        return block.split('\n') if block else []
+
+    def record(self, keys, tagged):
+        """Records the tagged lines of this run's segments (stored for the next run)."""
+        self.current.update(zip(keys, map('\n'.join, tagged)))
+
+
+class ResultCache:
+    """
+    Persistent on-disk cache of processed documents, keyed by a hash of the
+    file bytes, the language code and the tagger/dictionary version.
+    Entries are evicted least-recently-used first once the cache grows past
+    max_bytes (a hit refreshes the entry's modification time).
+    Also holds the segment fingerprints of documents tagged incrementally.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None  # total size on disk, computed on first store
+        self._versions = {}
+
+    def make_key(self, content_bytes, lang_code, options=''):
+        """options: any further settings that change the output (e.g. ElementSelection.signature())."""
+        version = self._versions.get(lang_code)
+        if version is None:
+            version = self._versions[lang_code] = get_tagger_version(lang_code)
+        digest = hashlib.sha256()
+        digest.update(f"{lang_code}\0{version}\0".encode('utf-8'))
+        if options:
+            digest.update(f"{options}\0".encode('utf-8'))
+        digest.update(content_bytes)
+        return digest.hexdigest()
+
+    def _path(self, key, suffix='.xml'):
+        return os.path.join(self.directory, key[:2], f"{key}{suffix}")
+
+    def get(self, key):
+        """Returns the cached processed XML (UTF-8 bytes) for key, or None."""
+        if self.max_bytes <= 0:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                processed_xml = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return processed_xml
+
+    def put(self, key, processed_xml):
+        """Stores a processed document (UTF-8 bytes), evicting old entries if the cache is full."""
+        if self.max_bytes <= 0:
+            return
+        self._store(self._path(key), processed_xml)
+
+    def get_segments(self, key):
+        """
+        Returns the SegmentFingerprints stored under key, empty if there are
+        none, or None when the cache is disabled.
+        """
+        if self.max_bytes <= 0:
+            return None
+        path = self._path(key, SEGMENTS_SUFFIX)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                previous = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return SegmentFingerprints()
+        return SegmentFingerprints(previous)
+
+    def put_segments(self, key, fingerprints):
+        """Stores the segments recorded in this run, replacing the previous ones."""
+        if self.max_bytes <= 0:
+            return
+        data = gzip.compress(json.dumps(fingerprints.current, ensure_ascii=False).encode('utf-8'), compresslevel=1)
+        self._store(self._path(key, SEGMENTS_SUFFIX), data)
+
+    def _store(self, path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                replaced_size = os.path.getsize(path)
+            except OSError:
+                replaced_size = 0
+            # Write to a temporary file first so concurrent readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += os.path.getsize(path) - replaced_size
+            if self._size > self.max_bytes:
+                self._evict()
+        except OSError:
+            pass  # The cache is an optimisation only; never fail a run because of it
+
+    def _entries(self):
+        """Yields (path, size, last_used) for every entry on disk."""
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(('.xml', SEGMENTS_SUFFIX)):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Removes least-recently-used entries until the cache is below 90% of max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+RESULT_CACHE = ResultCache(
+    directory=CACHE_DIR,
+    max_bytes=int(os.environ.get("TAGGER_CACHE_MAX_BYTES", 1 << 30))
+)
+
+
+# --- Streaming XML Processing ---
+
+# Size of the chunks read from the input stream.
+STREAM_CHUNK_SIZE = 1 << 20
+# Tagged text is buffered and written out once this many characters are pending,
+# so segments are still tagged in batches while memory stays bounded.
+STREAM_FLUSH_CHARS = 1 << 20
+# A single text node larger than this is tagged in pieces (see _StreamingXMLTagger._partial_text_cut).
+STREAM_MAX_SEGMENT_CHARS = 4 << 20
+# Everything up to and including the last whitespace character.
+LAST_WHITESPACE_PATTERN = re.compile(r'.*\s', re.DOTALL)
+
+XML_DECLARATION_PATTERN = re.compile(r'^\ufeff?\s*<\?xml[^>]*\?>', re.IGNORECASE)
+ATTRIBUTE_ENTITIES = {'"': '&quot;', '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'}
+
+
+class _StreamingXMLTagger:
+    """
+    Expat handlers that tag text as soon as the surrounding tags are known and
+    write the result incrementally. Produces the same output as
+    process_xml_content with the stdlib backend, except that namespace
+    prefixes are kept as written; the lxml backend (the default when
+    installed) differs in serialization details, e.g. <x/> for <x />.
+    """
+
+    def __init__(self, output_stream, tagger_function, metrics=None, selection=None):
+        self.output_stream = output_stream
+        self.tagger_function = tagger_function
+        self.metrics = metrics
+        # With an ElementSelection: the selection states of the open elements, the wrapper's first
+        self.selection = selection or None
+        self.states = [selection.root_state()] if self.selection else None
+        self.depth = 0
+        self.pending_start = None  # start tag not yet written (may become <tag />)
+        self.text_buffer = []
+        self.text_chars = 0
+        self.segment_open = False  # part of the current text node is already tagged
+        self.pieces = []  # ('raw', markup) or ('full'/'part', text to tag), in output order
+        self.pending_chars = 0
+        self.at_start = True
+        self.trailing_whitespace = ''
+
+    # 1. Expat callbacks
+    def start_element(self, name, attrs):
+        self.depth += 1
+        if self.depth == 1:
+            return  # TEMP_WRAPPER
+        self._flush_text()
+        self._write_pending_start()
+        self.pending_start = (name, attrs)
+        if self.selection is not None:
+            self.states.append(self.selection.state(name, attrs, self.states[-1]))
+
+    def end_element(self, name):
+        self.depth -= 1
+        if self.depth == 0:
+            self._flush_text()
+            return
+        if self.pending_start is not None and not self.text_buffer:
+            self._add_raw(self._start_tag(*self.pending_start, empty=True))
+            self.pending_start = None
+        else:
+            self._flush_text()
+            self._write_pending_start()
+            self._add_raw(f"</{name}>")
+        if self.selection is not None:
+            self.states.pop()
+        if self.pending_chars >= STREAM_FLUSH_CHARS:
+            self.flush()
+
+    def character_data(self, data):
+        self.text_buffer.append(data)
+        self.text_chars += len(data)
+        if self.text_chars >= STREAM_MAX_SEGMENT_CHARS:
+            self._flush_partial_text()
+
+    # 2. Buffering of text segments and markup
+    def _start_tag(self, name, attrs, empty=False):
+        attributes = ''.join(f' {key}="{escape(value, ATTRIBUTE_ENTITIES)}"' for key, value in attrs.items())
+        return f"<{name}{attributes}{' /' if empty else ''}>"
+
+    def _write_pending_start(self):
+        if self.pending_start is not None:
+            self._add_raw(self._start_tag(*self.pending_start))
+            self.pending_start = None
+
+    def _add_raw(self, markup):
+        self.pieces.append(('raw', markup))
+        self.pending_chars += len(markup)
+
+    def _add_text(self, kind, text):
+        self.pieces.append((kind, text))
+        self.pending_chars += len(text)
+
+    def _tags_text(self):
+        """Whether text in the innermost open element is tagged (see ElementSelection)."""
+        return self.states is None or self.states[-1][0]
+
+    def _take_text(self):
+        text = ''.join(self.text_buffer)
+        self.text_buffer = []
+        self.text_chars = 0
+        return text
+
+    def _flush_partial_text(self):
+        """Queues the first part of an oversized text node for tagging, keeping only the rest buffered."""
+        text = self._take_text()
+        if not self._tags_text() or not text.strip():
+            # Nothing to tag; blank text inside a segment is dropped, as when the node ends
+            if not self.segment_open:
+                self._write_pending_start()
+                self._add_raw(escape(text))
+                self.flush()
+            return
+        cut = self._partial_text_cut(text)
+        self._write_pending_start()
+        self._add_text('part', text[:cut])
+        self.segment_open = True
+        if cut < len(text):
+            self.text_buffer, self.text_chars = [text[cut:]], len(text) - cut
+        self.flush()
+
+    def _partial_text_cut(self, text):
+        """
+        Where to cut an oversized text node: after its last line break, else
+        at a sentence boundary, else after its last whitespace, else (one
+        giant token) at the end of the buffer, so the buffer never holds more
+        than about STREAM_MAX_SEGMENT_CHARS. The part before the cut has text.
+        """
+        cut = text.rfind('\n') + 1
+        if cut and text[:cut].strip():
+            return cut
+        find_boundary = CHUNK_BOUNDARY_FINDERS.get(LANGUAGE_OF_TAGGER.get(self.tagger_function))
+        if find_boundary is not None:
+            cut = find_boundary(text, len(text))
+            if cut and text[:cut].strip():
+                return cut
+        match = LAST_WHITESPACE_PATTERN.match(text)
+        if match and text[:match.end()].strip():
+            return match.end()
+        return len(text)
+
+    def _flush_text(self):
+        """Queues the finished text node (an element's .text or .tail)."""
+        if not self.text_buffer and not self.segment_open:
+            return
+        text = self._take_text()
+        if self.segment_open:
+            if text.strip():
+                self._add_text('part', text)
+            self._add_raw('\n')
+            self.segment_open = False
+        elif text.strip() and self._tags_text():
+            self._write_pending_start()
+            self._add_text('full', text)
+        else:
+            self._write_pending_start()
+            self._add_raw(escape(text))
+
+    # 3. Tagging and output
+    def flush(self):
+        """Tags every queued segment in one batch and writes all queued output."""
+        texts = [value for kind, value in self.pieces if kind != 'raw']
+        with timed_stage(self.metrics, 'tag'):
+            tagged_segments = tag_segments(texts, self.tagger_function)
+        if self.metrics is not None:
+            self.metrics["segments"] += len(texts)
+            self.metrics["tokens"] += sum(len(tagged_lines) for tagged_lines in tagged_segments)
+        tagged = iter(tagged_segments)
+        for kind, value in self.pieces:
+            if kind == 'raw':
+                self._write(value)
+            elif kind == 'full':
+                self._write(escape('\n' + '\n'.join(next(tagged)) + '\n'))
+            else:
+                self._write(escape('\n' + '\n'.join(next(tagged))))
+        self.pieces = []
+        self.pending_chars = 0
+
+    def _write(self, text):
+        # Mirrors the final .strip() of process_xml_content without buffering the document.
+        if self.at_start:
+            text = text.lstrip()
+            if not text:
+                return
+            self.at_start = False
+        content = text.rstrip()
+        if content:
+            self.output_stream.write(self.trailing_whitespace + content)
+            self.trailing_whitespace = text[len(content):]
+        else:
+            self.trailing_whitespace += text
+
+
+def _iter_decoded_chunks(input_stream, chunk_size):
+    """Reads a binary stream and yields UTF-8 decoded text chunks."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = input_stream.read(chunk_size)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _tag_raw_text_stream(input_stream, output_stream, lang_code, tagger_function, chunk_size, metrics=None):
+    """
+    Raw-text fallback for streams: tags the input in line-aligned chunks (cut
+    at whitespace instead when a line outgrows STREAM_MAX_SEGMENT_CHARS). Like
+    process_xml_content, counts the input as one segment.
+    """
+    write = output_stream.write
+    token_writer = TOKEN_WRITERS.get(tagger_function)
+
+    def write_tokens(text):
+        if not text.strip():
+            return 0
+        if token_writer is not None:
+            return token_writer(text, write)
+        tagged_lines = tagger_function(text)
+        for line in tagged_lines:
+            write('\n' + line)
+        return len(tagged_lines)
+
+    write(f'<text lang="{lang_code}">')
+    count = 0
+    remainder = ''
+    with timed_stage(metrics, 'tag'):
+        for text in _iter_decoded_chunks(input_stream, chunk_size):
+            text = remainder + text
+            cut = text.rfind('\n') + 1
+            if not cut and len(text) >= STREAM_MAX_SEGMENT_CHARS:
+                match = LAST_WHITESPACE_PATTERN.match(text)
+                cut = match.end() if match else len(text)
+            text, remainder = text[:cut], text[cut:]
+            count += write_tokens(text)
+        count += write_tokens(remainder)
+    write('\n</text>' if count else '\n\n</text>')
+    if metrics is not None:
+        metrics["segments"] += 1
+        metrics["tokens"] += count
+
+
+def process_xml_stream(input_stream, output_stream, lang_code, tagger_function, chunk_size=STREAM_CHUNK_SIZE,
+                       metrics=None, selection=None):
+    """
+    Streaming variant of process_xml_content for files too large to hold in memory.
+    Reads UTF-8 bytes from input_stream, tags text as elements close and writes
+    the tagged XML to the text stream output_stream as it goes. Tagging time and
+    counts are added to the optional metrics record; text the optional
+    ElementSelection leaves out is copied untagged.
+
+    If the input is not well-formed XML it is tagged as raw text instead, which
+    requires both streams to be seekable (as regular files are).
+    """
+    input_start = input_stream.tell()
+    output_start = output_stream.tell()
+    counts = {key: metrics[key] for key in ('segments', 'tokens', 'tag_seconds')} if metrics is not None else None
+
+    def rewind():
+        """Discards the output of a failed pass, and its counts with it."""
+        input_stream.seek(input_start)
+        output_stream.seek(output_start)
+        output_stream.truncate()
+        if metrics is not None:
+            metrics.update(counts)
+
+    try:
+        _parse_xml_stream(input_stream, output_stream, tagger_function, chunk_size, metrics, selection)
+        return
+    except expat.ExpatError as e:
+        error = e
+    # Same behaviour as process_xml_content: discard the partial output, then parse
+    # again with the input repaired, and tag it as raw text if that fails too.
+    if XML_RECOVER:
+        rewind()
+        repairer = XMLRepairer()
+        try:
+            _parse_xml_stream(input_stream, output_stream, tagger_function, chunk_size, metrics, selection, repairer)
+            pipeline_warning(f"Input failed XML parsing ({error}). Made {repairer.summary()} and kept the markup.")
+            if metrics is not None:
+                metrics["repairs"] += repairer.repair_count
+            return
+        except expat.ExpatError:
+            pass
+    pipeline_warning(f"Input failed XML parsing ({error}). Processing as raw text only.")
+    rewind()
+    _tag_raw_text_stream(input_stream, output_stream, lang_code, tagger_function, chunk_size, metrics)
+
+
+def _parse_xml_stream(input_stream, output_stream, tagger_function, chunk_size, metrics=None, selection=None,
+                      repairer=None):
+    """
+    Parses and tags the input stream for process_xml_stream, passing the text
+    through the optional XMLRepairer first. Raises expat.ExpatError.
+    """
+    handler = _StreamingXMLTagger(output_stream, tagger_function, metrics, selection)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.character_data
+
+    def parse(text, final=False):
+        if repairer is not None:
+            text = repairer.feed(text, final=final)
+        parser.Parse(text, False)
+
+    parser.Parse('<TEMP_WRAPPER>', False)
+    # Hold back the start of the input until any XML declaration is complete, then drop it
+    head = ''
+    for text in _iter_decoded_chunks(input_stream, chunk_size):
+        if head is not None:
+            head += text
+            if '>' not in head and len(head) < 4096:
+                continue
+            text, head = XML_DECLARATION_PATTERN.sub('', head, count=1), None
+        parse(text)
+    parse(XML_DECLARATION_PATTERN.sub('', head, count=1) if head else '', final=True)
+    parser.Parse('</TEMP_WRAPPER>', True)
+    handler.flush()
+
+
+# --- Parallel File Processing ---
+
+def iter_processed_files(files, lang_code, tagger_function, workers=1, with_token_rows=False, selection=None,
+                         incremental=False):
+    """
+    Tags a list of (filename, content_bytes) pairs and yields
+    (index, filename, processed_xml, metrics, token_rows, error) as each file
+    completes. token_rows is None unless with_token_rows is set. On failure
+    processed_xml and metrics are None. selection is an optional ElementSelection;
+    incremental re-tags only what changed since each filename's last run.
+
+    With workers > 1 the files are spread over a process pool, so results
+    arrive in completion order; callers use the index to restore input order.
+    A single file is tagged here instead, with very large texts in it split
+    over the workers.
+    """
+    if workers <= 1 or len(files) <= 1:
+        for i, (filename, content_bytes) in enumerate(files):
+            try:
+                token_rows = [] if with_token_rows else None
+                processed_xml, metrics = process_file_bytes(filename, content_bytes, lang_code, tagger_function,
+                                                            token_rows=token_rows, selection=selection,
+                                                            incremental=incremental, workers=workers)
+                yield i, filename, processed_xml, metrics, token_rows, None
+            except Exception as e:
+                yield i, filename, None, None, None, e
+        return
+
+    # The selection goes to the workers as rule text: its class may belong to a
+    # Streamlit `__main__` module that a rerun has since replaced.
+    rules = None
+    if selection:
+        rules = ([rule.rule for rule in selection.include], [rule.rule for rule in selection.exclude])
+    with tagging_worker_pool(lang_code, min(workers, len(files))) as executor:
+        futures = {
+            executor.submit(tagging_worker.process_file, filename, content_bytes, lang_code, with_token_rows,
+                            rules, incremental): (i, filename)
+            for i, (filename, content_bytes) in enumerate(files)
+        }
+        for future in as_completed(futures):
+            i, filename = futures[future]
+            try:
+                processed_xml, metrics, token_rows = future.result()
+                yield i, filename, processed_xml, metrics, token_rows, None
+            except Exception as e:
+                yield i, filename, None, None, None, e
 
 
 # --- XML Creation and Zipping ---
 
-def create_output_file_content(processed_xml, original_filename):
-    """Creates the final XML output file content."""
+OUTPUT_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+def create_output_filename(original_filename):
+    """Returns the name of the tagged XML file produced for an input file."""
     base_filename = os.path.splitext(original_filename)[0]
     sanitized_base_name = re.sub(r' \(\d+\)$', '', base_filename).strip()
-    final_output = f'<?xml version="1.0" encoding="UTF-8"?>\n{processed_xml}'
-    return final_output, f"{sanitized_base_name}_tagged.xml"
+    return f"{sanitized_base_name}_tagged.xml"
+
+def create_output_file_content(processed_xml, original_filename):
+    """Creates the final XML output file content."""
+    final_output = f'{OUTPUT_XML_DECLARATION}{processed_xml}'
+    return final_output, create_output_filename(original_filename)
+
+
+# Characters encoded per write when streaming a document into a ZIP entry.
+ZIP_WRITE_CHUNK_CHARS = 1 << 20
+
+class TaggedZipWriter:
+    """
+    Builds the ZIP archive of tagged XML files one entry at a time.
+    Each document is compressed as soon as it is added, so callers can drop
+    their copy straight away. By default the archive is spilled to an
+    anonymous temporary file on disk instead of being held in memory.
+
+    With token_table_format ('parquet' or 'arrow') the tokens of every
+    document are also written to one columnar table inside the archive;
+    include_xml=False leaves out the XML files.
+    """
+
+    def __init__(self, fileobj=None, token_table_format=None, include_xml=True):
+        self.fileobj = fileobj if fileobj is not None else tempfile.TemporaryFile()
+        self.zip_file = zipfile.ZipFile(self.fileobj, 'w', zipfile.ZIP_DEFLATED)
+        self.include_xml = include_xml
+        self.token_table = TokenTableWriter(token_table_format) if token_table_format else None
+        self.count = 0
+
+    def add(self, original_name, processed_xml, token_rows=None):
+        """
+        Compresses one processed document (str or UTF-8 bytes) into the
+        archive and returns the ZipInfo of its XML entry (None when XML is
+        left out).
+        """
+        info = None
+        if self.include_xml:
+            xml_name = create_output_filename(original_name)
+            with self.zip_file.open(xml_name, 'w', force_zip64=True) as entry:
+                entry.write(OUTPUT_XML_DECLARATION.encode('utf-8'))
+                if isinstance(processed_xml, bytes):
+                    entry.write(processed_xml)
+                else:
+                    for start in range(0, len(processed_xml), ZIP_WRITE_CHUNK_CHARS):
+                        entry.write(processed_xml[start:start + ZIP_WRITE_CHUNK_CHARS].encode('utf-8'))
+            info = self.zip_file.getinfo(xml_name)
+        if self.token_table is not None and token_rows is not None:
+            self.token_table.write(original_name, token_rows)
+        self.count += 1
+        return info
+
+    def close(self):
+        """Finishes the archive and returns its file object, rewound to the start."""
+        if self.token_table is not None:
+            table_file = self.token_table.close()
+            info = zipfile.ZipInfo(self.token_table.filename, date_time=time.localtime()[:6])
+            # Parquet pages are already zstd-compressed: store them as is. The Arrow
+            # IPC stream is written uncompressed, so it is deflated like the XML.
+            info.compress_type = zipfile.ZIP_STORED if self.token_table.compressed else zipfile.ZIP_DEFLATED
+            with self.zip_file.open(info, 'w', force_zip64=True) as entry:
+                shutil.copyfileobj(table_file, entry)
+            table_file.close()
+        self.zip_file.close()
+        self.fileobj.seek(0)
+        return self.fileobj
+
+
+def create_zip_archive(output_data, token_rows=None, token_table_format=None):
+    """
+    Creates a zip archive in memory and returns the bytes.
+    token_rows maps original names to their token rows when a token table is wanted.
+    """
+    writer = TaggedZipWriter(BytesIO(), token_table_format=token_table_format)
+    for original_name, processed_content in output_data.items():
+        writer.add(original_name, processed_content, (token_rows or {}).get(original_name))
+    return writer.close().getvalue()
+
+
+# --- Columnar Token Tables ---
+
+# Choices offered in the UI -> token table format.
+TOKEN_TABLE_CHOICES = {
+    "None": None,
+    "Parquet": "parquet",
+    "Arrow IPC": "arrow",
+}
+
+# Output format -> file name of the token table inside the archive.
+TOKEN_TABLE_FILENAMES = {
+    "parquet": "tokens.parquet",
+    "arrow": "tokens.arrows",  # Arrow IPC stream format
+}
+
+class TokenTableWriter:
+    """
+    Writes token rows of many documents into one Parquet or Arrow IPC table,
+    one row group / record batch per document, written to fileobj (by
+    default a temporary file).
+    Columns: doc_id, segment, path, token, pos, lemma, start, end, with
+    doc_id, path, pos and lemma dictionary-encoded. Needs the optional
+    pyarrow package.
+    """
+
+    def __init__(self, table_format, fileobj=None):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise RuntimeError("Token table output requires the 'pyarrow' package (pip install pyarrow).")
+        if table_format not in TOKEN_TABLE_FILENAMES:
+            raise ValueError(f"Unknown token table format: {table_format}")
 
+        self.pa = pa
+        self.filename = TOKEN_TABLE_FILENAMES[table_format]
+        self.compressed = table_format == "parquet"
+        self.fileobj = fileobj if fileobj is not None else tempfile.TemporaryFile()
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([
+            ("doc_id", dictionary),
+            ("segment", pa.int32()),
+            ("path", dictionary),
+            ("token", pa.string()),
+            ("pos", dictionary),
+            ("lemma", dictionary),
+            ("start", pa.int32()),
+            ("end", pa.int32()),
+        ])
+        if table_format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.fileobj, self.schema, compression='zstd')
+        else:
+            # The stream format allows a new dictionary for every batch
+            self.writer = pa.ipc.new_stream(self.fileobj, self.schema)
 
-def create_zip_archive(output_data):
-    """Creates a zip archive in memory and returns the bytes."""
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for original_name, processed_content in output_data.items():
-            final_content, xml_name = create_output_file_content(processed_content, original_name)
-            zf.writestr(xml_name, final_content.encode('utf-8'))
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    def write(self, doc_id, token_rows):
+        """Writes the rows of one document (see collect_token_rows)."""
+        if not token_rows:
+            return
+        pa = self.pa
+        segment, path, token, pos, lemma, start, end = zip(*token_rows)
+        table = pa.table([
+            pa.DictionaryArray.from_arrays(pa.array([0] * len(token_rows), pa.int32()), pa.array([doc_id])),
+            pa.array(segment, pa.int32()),
+            pa.array(path, pa.string()).dictionary_encode(),
+            pa.array(token, pa.string()),
+            pa.array(pos, pa.string()).dictionary_encode(),
+            pa.array(lemma, pa.string()).dictionary_encode(),
+            pa.array(start, pa.int32()),
+            pa.array(end, pa.int32()),
+        ], schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        """Finishes the table and returns its temporary file, rewound to the start."""
+        self.writer.close()
+        self.fileobj.seek(0)
+        return self.fileobj
+
+
+# --- Background Tagging Jobs ---
+# Every widget interaction reruns the Streamlit script from the top, so a run
+# is executed by a background thread and only its job id is kept in the
+# session; each rerun polls the job instead of tagging the files again.
+
+# How often a page with a running job refreshes its progress.
+TAGGING_JOB_POLL_SECONDS = 1.0
+# Finished jobs (and archives never downloaded) are dropped after this long.
+TAGGING_JOB_RETENTION_SECONDS = 60 * 60
+
+class TaggingJob:
+    """
+    One tagging run over a session's uploaded files. Results stream into
+    the job as files complete: messages ((kind, text) pairs, kind being the
+    st function used to show them), the done count and, at the end, the
+    metrics rows and the archive, which stays in its temporary file until it
+    is downloaded.
+    """
+
+    def __init__(self, files, lang_code, tagger_function, archive, pool=None, workers=1, with_token_rows=False,
+                 selection=None, incremental=False):
+        self.id = uuid.uuid4().hex
+        self.lang_code = lang_code
+        self.tagger_function = tagger_function
+        self.archive = archive
+        self.pool = pool
+        self.workers = workers
+        self.with_token_rows = with_token_rows
+        self.selection = selection
+        self.incremental = incremental
+        self.files = files
+        self.total = len(files)
+        self.done = 0
+        self.state = "queued"  # queued (waiting for a thread or a tagger) -> running -> finished/failed
+        self.messages = []
+        self.file_metrics = []
+        self.archive_file = None
+        self.archive_lock = threading.Lock()  # The download and the expiry run in different threads
+        self.downloaded = False
+        self.finalize_seconds = 0.0
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.state in ("finished", "failed")
+
+    def run(self):
+        """Tags the files and builds the archive; runs in a TaggingJobRegistry thread."""
+        try:
+            self._tag_files()
+            state = "finished"
+        except Exception as e:
+            logger.exception("Tagging job %s failed", self.id)
+            self.error = e
+            state = "failed"
+        self.files = None  # The uploads are no longer needed
+        self.finished_at = time.time()
+        self.state = state
+
+    def _tag_files(self):
+        # Finished files waiting for an earlier file, so the archive keeps upload order
+        # regardless of completion order. Failed files are recorded as None.
+        pending = {}
+        next_index = 0
+        file_metrics = {}
+
+        # A tagger of our own for this run, so concurrent sessions never share one
+        with borrow_tagger(self.lang_code, self.pool), collect_pipeline_warnings() as warnings:
+            self.state = "running"
+            for done, (i, filename, processed_xml, metrics, token_rows, error) in enumerate(
+                iter_processed_files(self.files, self.lang_code, self.tagger_function, workers=self.workers,
+                                     with_token_rows=self.with_token_rows, selection=self.selection,
+                                     incremental=self.incremental), start=1
+            ):
+                self.messages.extend(("warning", warning) for warning in warnings)
+                warnings.clear()
+                if error is None:
+                    pending[i] = (filename, processed_xml, token_rows)
+                    file_metrics[i] = metrics
+                    repairs = f" ({metrics['repairs']} markup repairs)" if metrics["repairs"] else ""
+                    self.messages.append(("success", f"✅ Processed: **{filename}**{repairs}"))
+                else:
+                    pending[i] = None
+                    self.messages.append(("error", f"❌ Failed to process {filename}: {error}"))
+
+                while next_index in pending:
+                    result = pending.pop(next_index)
+                    if result is not None:
+                        metrics = file_metrics[next_index]
+                        with timed_stage(metrics, 'zip'):
+                            info = self.archive.add(*result)
+                        if info is not None:
+                            metrics["output_bytes"] = info.file_size
+                            metrics["compressed_bytes"] = info.compress_size
+                        metrics["total_seconds"] += metrics["zip_seconds"]
+                        log_file_metrics(metrics)
+                    next_index += 1
+
+                self.done = done
+
+        if self.archive.count:
+            finalize_start = time.perf_counter()
+            self.archive_file = self.archive.close()
+            self.finalize_seconds = time.perf_counter() - finalize_start
+        self.file_metrics = [file_metrics[i] for i in sorted(file_metrics)]
+
+    def mark_downloaded(self):
+        """Click handler of the download button: hides the button on the rerun it triggers."""
+        self.downloaded = True
+
+    def read_archive(self):
+        """
+        Returns the archive's bytes and then releases it. st.download_button
+        calls this when the button is clicked, so the archive is only read
+        into memory for the download itself.
+        """
+        with self.archive_lock:
+            if self.archive_file is None:
+                raise RuntimeError("The archive has already been downloaded or has expired.")
+            self.archive_file.seek(0)
+            data = self.archive_file.read()
+        self.release_archive()
+        return data
+
+    def release_archive(self):
+        """Closes (and so deletes) the archive's temporary file."""
+        with self.archive_lock:
+            if self.archive_file is not None:
+                self.archive_file.close()
+                self.archive_file = None
+
+
+class TaggingJobRegistry:
+    """
+    Process-wide table of tagging jobs by id, with the thread pool that runs
+    them. Finished jobs are dropped TAGGING_JOB_RETENTION_SECONDS after they
+    end, whether or not their archive was downloaded.
+    """
+
+    def __init__(self, max_workers, retention_seconds=TAGGING_JOB_RETENTION_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tagging-job")
+        self.retention_seconds = retention_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()  # Streamlit sessions share this process
+
+    def submit(self, job):
+        """Queues job for execution and returns its id."""
+        with self.lock:
+            self._expire()
+            self.jobs[job.id] = job
+        self.executor.submit(job.run)
+        return job.id
+
+    def get(self, job_id):
+        """Returns the job with job_id, or None if there is none (any more)."""
+        with self.lock:
+            self._expire()
+            return self.jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            job.release_archive()
+
+    def _expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.retention_seconds]
+        for job_id in expired:
+            self.jobs.pop(job_id).release_archive()
+
+@st.cache_resource
+def get_tagging_jobs():
+    """Returns the process-wide job registry; cached so that it outlives the script reruns."""
+    return TaggingJobRegistry(TAGGER_POOL_SIZE)
 
 
 # --- Streamlit UI Components ---
@@ -186,6 +2810,8 @@ def language_selector_page():
         lang_code = "EN"
     
     if tagger_func:
+        with st.spinner(f"Loading the {language} tokenizer..."):
+            load_language_backend(lang_code)
         tokenizer_interface(
             lang_name=language, 
             lang_code=lang_code, 
@@ -214,37 +2840,346 @@ def tokenizer_interface(lang_name, lang_code, tagger_function):
         help="Ensure your text files are encoded in UTF-8."
     )
 
+    max_workers = os.cpu_count() or 1
+    workers = st.number_input(
+        "Worker processes",
+        min_value=1,
+        max_value=max_workers,
+        value=1,
+        help=f"Tag several files at once using separate processes (up to {max_workers} on this machine). "
+             "A single very large file is split at sentence boundaries and tagged by the processes together."
+    )
+
+    token_table_choice = st.selectbox(
+        "Token table output",
+        list(TOKEN_TABLE_CHOICES),
+        help="Also write every token (document, element path, token, POS, lemma, offsets) "
+             "to one columnar table in the archive, for fast loading with pandas/Arrow."
+    )
+    token_table_format = TOKEN_TABLE_CHOICES[token_table_choice]
+    include_xml = True
+    if token_table_format:
+        include_xml = st.checkbox("Include tagged XML files in the archive", value=True)
+
+    incremental = st.checkbox(
+        "Only re-tag changed text",
+        help="Reuse the tags of every paragraph that is unchanged since a file with the same name was last "
+             "tagged, so re-uploading a corrected file only tags the edited parts."
+    )
+
+    col_include, col_exclude = st.columns(2)
+    include_rules = col_include.text_input(
+        "Only tag inside",
+        help="Comma-separated elements whose text is tagged; everything else is copied as is. "
+             "Element names, simple paths (text/body, /TEI/text, body//p) and attribute "
+             "predicates (div[@type='chapter'], @type='meta'). Leave empty to tag everything."
+    )
+    exclude_rules = col_exclude.text_input(
+        "Never tag inside",
+        placeholder="teiHeader, note, @type='meta'",
+        help="Comma-separated elements (same syntax) copied through untagged, with everything inside them."
+    )
+
+    jobs = get_tagging_jobs()
+    job_key = f"tagging_job_{lang_code}"
+    job = jobs.get(st.session_state.get(job_key))
+
     if uploaded_files:
-        if st.button(f"Start Tagging and Preserve XML Structure"):
-            output_data = {}
-            progress_bar = st.progress(0, text="Processing files...")
-            
-            for i, uploaded_file in enumerate(uploaded_files):
-                filename = uploaded_file.name
+        if st.button(f"Start Tagging and Preserve XML Structure", disabled=job is not None and not job.finished):
+            try:
+                selection = ElementSelection.from_text(include_rules, exclude_rules)
+                archive = TaggedZipWriter(token_table_format=token_table_format, include_xml=include_xml)
+            except (RuntimeError, ValueError) as e:
+                st.error(f"❌ {e}")
+                return
+            files = [(uploaded_file.name, uploaded_file.read()) for uploaded_file in uploaded_files]
+            if job is not None:
+                jobs.discard(job.id)  # Replaced by the new run
+            job = TaggingJob(files, lang_code, tagger_function, archive, pool=get_tagger_pool(lang_code),
+                             workers=int(workers), with_token_rows=bool(token_table_format),
+                             selection=selection, incremental=incremental)
+            st.session_state[job_key] = jobs.submit(job)
+
+    if job is not None:
+        show_tagging_job(job, lang_name)
+
+def show_tagging_job(job, lang_name):
+    """Shows a job's progress while it runs; once it has finished, its messages, archive and statistics."""
+    if not job.finished:
+        tagging_job_progress(job, lang_name)
+        return
+
+    for kind, text in list(job.messages):
+        getattr(st, kind)(text)
+    if job.error is not None:
+        st.error(f"❌ Tagging stopped: {job.error}")
+
+    if job.archive_file is not None and not job.downloaded:
+        st.subheader("Download Results")
+        # data is read from the job's temporary file only when the button is clicked
+        st.download_button(
+            label=f"⬇️ Download Tagged XML Archive",
+            data=job.read_archive,
+            file_name=f"{job.lang_code.lower()}_preserved_tagged_xml.zip",
+            mime="application/zip",
+            on_click=job.mark_downloaded
+        )
+    elif job.downloaded:
+        st.info("The archive has been downloaded. Start tagging again to rebuild it "
+                "(unchanged files come straight from the result cache).")
+
+    if job.file_metrics:
+        metrics_panel(job.file_metrics, job.lang_code, job.finalize_seconds)
+
+@st.fragment(run_every=TAGGING_JOB_POLL_SECONDS)
+def tagging_job_progress(job, lang_name):
+    """Polls a running job; reruns the whole page once it has finished."""
+    if job.finished:
+        st.rerun()
+    if job.state == "queued":
+        st.info(f"⏳ All {lang_name} taggers are in use by other sessions; "
+                "tagging starts as soon as one is free...")
+    st.progress(job.done / job.total, text=f"Processed {job.done} of {job.total} files...")
+    for kind, text in list(job.messages):
+        getattr(st, kind)(text)
+
+def metrics_panel(rows, lang_code, finalize_seconds):
+    """Expandable per-file/per-stage timing table with JSON and CSV export."""
+    with st.expander("⏱️ Processing Statistics"):
+        total_seconds = sum(row["total_seconds"] for row in rows)
+        total_tokens = sum(row["tokens"] for row in rows)
+        cache_hits = sum(1 for row in rows if row["cache_hit"])
+        reused_segments = sum(row["reused_segments"] for row in rows)
+        st.markdown(
+            f"**{len(rows)}** files, **{total_tokens:,}** tokens in **{total_seconds:.2f} s** "
+            f"({cache_hits} from cache, {reused_segments:,} unchanged segments reused); "
+            f"archive finalized in {finalize_seconds:.2f} s."
+        )
+        st.dataframe(rows)
+        
+        col_json, col_csv = st.columns(2)
+        col_json.download_button(
+            label="Export as JSON",
+            data=export_metrics_json(rows),
+            file_name=f"{lang_code.lower()}_tagging_metrics.json",
+            mime="application/json"
+        )
+        col_csv.download_button(
+            label="Export as CSV",
+            data=export_metrics_csv(rows),
+            file_name=f"{lang_code.lower()}_tagging_metrics.csv",
+            mime="text/csv"
+        )
+
+# --- Command-Line Batch Interface ---
+
+# File types picked up when walking an input directory (same as the uploader).
+INPUT_EXTENSIONS = ('.txt', '.xml')
+
+
+def iter_input_files(input_dir):
+    """Yields (absolute_path, relative_dir) for every taggable file under input_dir."""
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        relative_dir = os.path.relpath(dirpath, input_dir)
+        for filename in sorted(filenames):
+            if filename.lower().endswith(INPUT_EXTENSIONS):
+                yield os.path.join(dirpath, filename), relative_dir
+
+
+def output_path_for(input_path, output_dir):
+    """Path of the tagged XML file tag_file_to_disk writes into output_dir for input_path."""
+    return os.path.join(output_dir, create_output_filename(os.path.basename(input_path)))
+
+
+def tag_file_to_disk(input_path, output_dir, lang_code, tagger_function, stream=False, use_cache=True,
+                     token_rows=None, selection=None, incremental=False, workers=1):
+    """
+    Tags a single file and writes the tagged XML into output_dir.
+    Returns (output_path, metrics).
+    With stream=True the file is parsed and written incrementally (see process_xml_stream).
+    selection is an optional ElementSelection; with incremental=True only the
+    parts changed since the last run of input_path are tagged. With
+    workers > 1, very large texts are tagged in parallel.
+    """
+    if stream:
+        output_path = output_path_for(input_path, output_dir)
+        metrics = new_file_metrics(input_path, os.path.getsize(input_path))
+        start = time.perf_counter()
+        with open(input_path, 'rb') as f_in, open(output_path, 'w', encoding='utf-8') as f_out:
+            f_out.write(OUTPUT_XML_DECLARATION)
+            process_xml_stream(f_in, f_out, lang_code, tagger_function, metrics=metrics, selection=selection)
+        metrics["output_bytes"] = os.path.getsize(output_path)
+        metrics["total_seconds"] = time.perf_counter() - start
+        return output_path, metrics
+
+    with open(input_path, 'rb') as f:
+        content_bytes = f.read()
+    processed_xml, metrics = process_file_bytes(input_path, content_bytes, lang_code, tagger_function,
+                                                use_cache=use_cache, token_rows=token_rows, selection=selection,
+                                                incremental=incremental, workers=workers)
+    with timed_stage(metrics, 'write'):
+        output_path = output_path_for(input_path, output_dir)
+        with open(output_path, 'wb') as f:
+            f.write(OUTPUT_XML_DECLARATION.encode('utf-8'))
+            f.write(processed_xml)
+    metrics["output_bytes"] = os.path.getsize(output_path)
+    metrics["total_seconds"] += metrics["write_seconds"]
+    return output_path, metrics
+
+
+def run_batch(input_dir, output_dir, lang_code, stream=False, use_cache=True, token_table_format=None,
+              selection=None, incremental=False, workers=1):
+    """
+    Tags every file under input_dir, mirroring its directory layout in output_dir.
+    With token_table_format, the tokens of all files are also written to one
+    table (tokens.parquet / tokens.arrows) in output_dir.
+    Returns (processed_count, failed_count, metrics_rows); raises
+    RuntimeError if the tagger for lang_code cannot be loaded.
+    """
+    # Without a page to show a failed load on, every file would silently get
+    # zero tokens: stop before tagging anything instead.
+    try:
+        with collect_pipeline_warnings() as warnings:
+            init_language_backend(lang_code)
+    except Exception as e:
+        raise RuntimeError(f"Could not load the {lang_code} tagger: {e}") from e
+    finally:
+        for warning in warnings:
+            print(f"Warning: {warning}", file=sys.stderr)
+    if current_tagger(lang_code) is None:
+        raise RuntimeError(f"Could not load the {lang_code} tagger.")
+
+    tagger_function = TAGGER_FUNCTIONS[lang_code]
+    processed, failed = 0, 0
+    rows = []
+    token_table = None
+    if token_table_format:
+        os.makedirs(output_dir, exist_ok=True)
+        table_path = os.path.join(output_dir, TOKEN_TABLE_FILENAMES[token_table_format])
+        token_table = TokenTableWriter(token_table_format, open(table_path, 'wb'))
+
+    # Output names drop the extension and any ' (N)' suffix, so 'a.txt', 'a.xml'
+    # and 'a (1).xml' share one: only the first is written, the others fail.
+    written = {}  # output path (normcased) -> input path it was written for
+
+    for input_path, relative_dir in iter_input_files(input_dir):
+        target_dir = os.path.normpath(os.path.join(output_dir, relative_dir))
+        output_key = os.path.normcase(output_path_for(input_path, target_dir))
+        if output_key in written:
+            failed += 1
+            print(f"Failed to process {input_path}: its output name is already used by {written[output_key]}",
+                  file=sys.stderr)
+            continue
+        written[output_key] = input_path
+        os.makedirs(target_dir, exist_ok=True)
+        token_rows = [] if token_table is not None else None
+        try:
+            # There is no page to show warnings on: collect them and print them with the file
+            with collect_pipeline_warnings() as warnings:
                 try:
-                    content_bytes = uploaded_file.read()
-                    text = content_bytes.decode('utf-8')
-                    processed_xml = process_text(text, lang_code, tagger_function)
-                    output_data[filename] = processed_xml
-                    st.success(f"✅ Processed: **{filename}**")
-                except Exception as e:
-                    st.error(f"❌ Failed to process {filename}: {e}")
-                
-                progress_bar.progress((i + 1) / len(uploaded_files), text=f"Processed {i+1} of {len(uploaded_files)} files...")
-            
-            progress_bar.empty()
-            
-            if output_data:
-                with st.spinner('Creating XML archive...'):
-                    zip_bytes = create_zip_archive(output_data)
-                
-                st.subheader("Download Results")
-                st.download_button(
-                    label=f"⬇️ Download Tagged XML Archive",
-                    data=zip_bytes,
-                    file_name=f"{lang_code.lower()}_preserved_tagged_xml.zip",
-                    mime="application/zip"
-                )
+                    output_path, metrics = tag_file_to_disk(input_path, target_dir, lang_code, tagger_function,
+                                                            stream=stream, use_cache=use_cache, token_rows=token_rows,
+                                                            selection=selection, incremental=incremental,
+                                                            workers=workers)
+                finally:
+                    for warning in warnings:
+                        print(f"Warning: {input_path}: {warning}", file=sys.stderr)
+            if token_table is not None:
+                token_table.write(os.path.relpath(input_path, input_dir), token_rows)
+            processed += 1
+            rows.append(metrics)
+            log_file_metrics(metrics)
+            repairs = f" ({metrics['repairs']} markup repairs)" if metrics["repairs"] else ""
+            print(f"Processed: {input_path} -> {output_path}{repairs}")
+        except Exception as e:
+            failed += 1
+            print(f"Failed to process {input_path}: {e}", file=sys.stderr)
+
+    if token_table is not None:
+        token_table.close().close()
+    return processed, failed, rows
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m app",
+        description="Multilingual Tokenizer & Tagger (headless batch mode)."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tag_parser = subparsers.add_parser("tag", help="Tag every .txt/.xml file in a directory.")
+    tag_parser.add_argument("--lang", choices=sorted(TAGGER_FUNCTIONS), required=True,
+                            help="Language code of the input files.")
+    tag_parser.add_argument("--stream", action="store_true",
+                            help="Parse and write each file incrementally to keep memory bounded on very large files.")
+    tag_parser.add_argument("--no-cache", action="store_true",
+                            help="Always re-tag files instead of reusing cached results.")
+    tag_parser.add_argument("--workers", type=int, default=1, metavar="N",
+                            help="Split very large texts (e.g. multi-gigabyte .txt transcripts) at sentence "
+                                 "boundaries and tag them in N processes; the output is the same.")
+    tag_parser.add_argument("--incremental", action="store_true",
+                            help="Re-tag only the text segments that changed since the last run of each file "
+                                 "(uses the result cache; not available with --stream or --no-cache).")
+    tag_parser.add_argument("--token-table", choices=sorted(TOKEN_TABLE_FILENAMES),
+                            help="Also write all tokens to one columnar table in the output directory "
+                                 "(needs pyarrow; not available with --stream).")
+    tag_parser.add_argument("--include", metavar="RULE", action="append", default=[],
+                            help="Only tag text inside elements matching RULE: a name, a simple path "
+                                 "('teiHeader/fileDesc', '/TEI/text', 'body//p') and/or attribute predicates "
+                                 "(\"div[@type='meta']\", \"@type='meta'\"). Repeatable.")
+    tag_parser.add_argument("--exclude", metavar="RULE", action="append", default=[],
+                            help="Copy elements matching RULE (same syntax as --include) through untagged, "
+                                 "e.g. --exclude teiHeader --exclude note. Repeatable.")
+    tag_parser.add_argument("--metrics", metavar="PATH",
+                            help="Write per-file, per-stage timings to PATH (.json or .csv).")
+    tag_parser.add_argument("input_dir", help="Directory containing the files to tag (searched recursively).")
+    tag_parser.add_argument("output_dir", help="Directory the tagged XML files are written to.")
+    return parser
+
+
+def cli_main(argv=None):
+    """Entry point for `python -m app tag ...`. Returns the process exit code."""
+    args = build_arg_parser().parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Input directory not found: {args.input_dir}", file=sys.stderr)
+        return 2
+    if args.token_table and args.stream:
+        print("--token-table cannot be combined with --stream.", file=sys.stderr)
+        return 2
+    if args.workers > 1 and args.stream:
+        # --stream tags a text node in pieces of at most STREAM_MAX_SEGMENT_CHARS, below PARALLEL_TEXT_MIN_CHARS
+        print("--workers cannot be combined with --stream.", file=sys.stderr)
+        return 2
+    if args.incremental and (args.stream or args.no_cache):
+        print("--incremental cannot be combined with --stream or --no-cache.", file=sys.stderr)
+        return 2
+    try:
+        selection = ElementSelection(args.include, args.exclude) if args.include or args.exclude else None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    try:
+        processed, failed, rows = run_batch(
+            args.input_dir, args.output_dir, args.lang,
+            stream=args.stream, use_cache=not args.no_cache, token_table_format=args.token_table,
+            selection=selection, incremental=args.incremental, workers=max(1, args.workers)
+        )
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.metrics:
+        export = export_metrics_csv if args.metrics.lower().endswith('.csv') else export_metrics_json
+        with open(args.metrics, 'w', encoding='utf-8', newline='') as f:
+            f.write(export(rows))
+
+    print(f"Done: {processed} processed, {failed} failed.")
+    memo = SEGMENT_MEMO.stats()
+    print(f"Segment memo: {memo['hits']} hits, {memo['misses']} misses, {memo['entries']} entries.")
+    return 1 if failed else 0
+
 
 def main():
     st.set_page_config(
@@ -258,4 +3193,9 @@ def main():
     language_selector_page()
 
 if __name__ == "__main__":
-    main()
+    # `streamlit run app.py` executes this file inside the Streamlit runtime;
+    # `python -m app ...` has no runtime and drives the headless CLI instead.
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(cli_main())
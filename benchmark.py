@@ -0,0 +1,394 @@
+"""
+Throughput benchmarks for the tagging pipeline.
+
+Generates synthetic corpora shaped like the files we process (flat plain text,
+deeply nested XML, highly fragmented XML with many tiny text nodes, and one
+large single file) and times each pipeline stage on them, reporting
+tokens/sec, documents/sec and peak Python memory.
+
+Usage:
+    python benchmark.py                      # all stages, both languages
+    python benchmark.py --lang JP --scale 5  # bigger fixtures, Japanese only
+    python benchmark.py --json results.json  # also write machine-readable results
+
+Peak memory is measured with tracemalloc in a separate pass, so it covers
+Python allocations only (not MeCab's own buffers) and does not slow the timings.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import app
+
+
+# --- Fixture Text ---
+
+JAPANESE_SENTENCES = [
+    "吾輩は猫である。",
+    "名前はまだ無い。",
+    "どこで生れたかとんと見当がつかぬ。",
+    "何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。",
+    "吾輩はここで始めて人間というものを見た。",
+    "しかもあとで聞くとそれは書生という人間中で一番獰悪な種族であったそうだ。",
+    "この書生というのは時々我々を捕えて煮て食うという話である。",
+    "しかしその当時は何という考もなかったから別段恐しいとも思わなかった。",
+]
+
+ENGLISH_SENTENCES = [
+    "The committee published its annual report on Tuesday.",
+    "Several researchers questioned the methodology used in the survey.",
+    "She walked slowly along the river, watching the boats drift past.",
+    "Prices rose sharply after the announcement, surprising most analysts.",
+    "The old library was finally reopened to the public last spring.",
+    "He could not remember where he had left the keys to the office.",
+    "Children were playing in the park while their parents talked nearby.",
+    "The new policy will take effect at the beginning of next year.",
+]
+
+SENTENCES = {"JP": JAPANESE_SENTENCES, "EN": ENGLISH_SENTENCES}
+
+
+def _sentences(lang_code, count, rng):
+    return [rng.choice(SENTENCES[lang_code]) for _ in range(count)]
+
+
+def _joiner(lang_code):
+    return "" if lang_code == "JP" else " "
+
+
+# --- Fixture Generators ---
+
+def make_flat_text(lang_code, sentences, rng):
+    """Plain text: paragraphs of sentences separated by blank lines."""
+    paragraphs = []
+    for _ in range(max(1, sentences // 8)):
+        paragraphs.append(_joiner(lang_code).join(_sentences(lang_code, 8, rng)))
+    return "\n\n".join(paragraphs)
+
+
+def make_nested_xml(lang_code, sentences, rng, depth=40):
+    """TEI-like document whose paragraphs sit deep inside nested <div> elements."""
+    body = []
+    for i in range(max(1, sentences // 4)):
+        text = _joiner(lang_code).join(_sentences(lang_code, 4, rng))
+        body.append(f'<div n="{i}">' * depth + f"<p>{text}</p>" + "</div>" * depth)
+    return (
+        f'<TEI><teiHeader><fileDesc><title>Nested</title></fileDesc></teiHeader>'
+        f'<text><body>{"".join(body)}</body></text></TEI>'
+    )
+
+
+def make_fragmented_xml(lang_code, sentences, rng):
+    """Highly fragmented markup: every word-sized piece is its own <w> element."""
+    words = []
+    for sentence in _sentences(lang_code, sentences, rng):
+        if lang_code == "JP":
+            pieces, i = [], 0
+            while i < len(sentence):
+                size = rng.randint(1, 3)
+                pieces.append(sentence[i:i + size])
+                i += size
+        else:
+            pieces = sentence.split()
+        words.extend(f'<w n="{len(words) + k}">{piece}</w>' for k, piece in enumerate(pieces))
+        words.append("<lb/>")
+    return f'<TEI><text><body><p>{" ".join(words)}</p></body></text></TEI>'
+
+
+def make_large_xml(lang_code, sentences, rng):
+    """One large document of many ordinary paragraphs."""
+    paragraphs = []
+    for i in range(max(1, sentences // 5)):
+        text = _joiner(lang_code).join(_sentences(lang_code, 5, rng))
+        paragraphs.append(f'<p n="{i}">{text}</p>')
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<corpus>\n' + "\n".join(paragraphs) + "\n</corpus>"
+
+
+def make_deep_xml(lang_code, depth, breadth, rng):
+    """A chain of `depth` nested <d> elements, each also holding `breadth` <w> leaves with text."""
+    words = _sentences(lang_code, 8, rng)
+    leaves = "".join(f"<w>{words[k % len(words)]}</w>" for k in range(breadth))
+    return "<TEI><text>" + f"<d>{leaves}" * depth + "</d>" * depth + "</text></TEI>"
+
+
+def build_fixtures(lang_code, scale, seed=0):
+    """Returns {fixture_name: [documents]} for lang_code."""
+    rng = random.Random(seed)
+    return {
+        "flat_text": [make_flat_text(lang_code, 200 * scale, rng) for _ in range(20)],
+        "nested_xml": [make_nested_xml(lang_code, 100 * scale, rng) for _ in range(10)],
+        "fragmented_xml": [make_fragmented_xml(lang_code, 100 * scale, rng) for _ in range(10)],
+        "large_single_file": [make_large_xml(lang_code, 5000 * scale, rng)],
+    }
+
+
+# --- Measurement ---
+
+def count_tokens(processed_xml):
+    """Each tagged token is one `token\\tPOS\\tlemma` line, i.e. two tabs."""
+    return processed_xml.count("\t") // 2
+
+
+def measure(function, repeat, reset=None):
+    """
+    Runs function `repeat` times and returns (best_seconds, result, peak_bytes).
+    `reset` is called before every run (e.g. to empty the segment memo).
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    if reset:
+        reset()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, result, peak
+
+
+def _stage_result(stage, lang_code, fixture, seconds, documents, tokens, peak):
+    return {
+        "stage": stage,
+        "lang": lang_code,
+        "fixture": fixture,
+        "seconds": round(seconds, 6),
+        "documents": documents,
+        "tokens": tokens,
+        "docs_per_sec": round(documents / seconds, 2) if seconds else None,
+        "tokens_per_sec": round(tokens / seconds, 1) if seconds else None,
+        "peak_mb": round(peak / (1 << 20), 2),
+    }
+
+
+def bench_tagger(lang_code, fixtures, repeat, reset):
+    """Raw tagger throughput on the flat plain-text fixture."""
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    documents = fixtures["flat_text"]
+    seconds, results, peak = measure(lambda: [tagger_function(doc) for doc in documents], repeat, reset)
+    tokens = sum(len(lines) for lines in results)
+    return [_stage_result(tagger_function.__name__, lang_code, "flat_text", seconds, len(documents), tokens, peak)]
+
+
+def bench_process_xml(lang_code, fixtures, repeat, reset):
+    """process_xml_content on every fixture."""
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    rows = []
+    for fixture, documents in fixtures.items():
+        seconds, results, peak = measure(
+            lambda: [app.process_xml_content(doc, lang_code, tagger_function) for doc in documents], repeat, reset
+        )
+        tokens = sum(count_tokens(xml) for xml in results)
+        rows.append(_stage_result("process_xml_content", lang_code, fixture, seconds, len(documents), tokens, peak))
+    return rows
+
+
+def bench_process_bytes(lang_code, fixtures, repeat, reset):
+    """process_xml_bytes (bytes in, bytes out) on the large single-file fixture."""
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    document = fixtures["large_single_file"][0].encode("utf-8")
+    seconds, result, peak = measure(lambda: app.process_xml_bytes(document, lang_code, tagger_function), repeat, reset)
+    return [_stage_result("process_xml_bytes", lang_code, "large_single_file", seconds, 1, result.count(b"\t") // 2, peak)]
+
+
+def bench_process_stream(lang_code, fixtures, repeat, reset):
+    """process_xml_stream on the large single-file fixture."""
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    document = fixtures["large_single_file"][0].encode("utf-8")
+
+    def run():
+        output = io.StringIO()
+        app.process_xml_stream(io.BytesIO(document), output, lang_code, tagger_function)
+        return output.getvalue()
+
+    seconds, result, peak = measure(run, repeat, reset)
+    return [_stage_result("process_xml_stream", lang_code, "large_single_file", seconds, 1, count_tokens(result), peak)]
+
+
+def bench_zip(lang_code, fixtures, repeat, reset):
+    """create_zip_archive on the tagged output of every fixture."""
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    output_data = {}
+    for fixture, documents in fixtures.items():
+        for i, doc in enumerate(documents):
+            output_data[f"{fixture}_{i}.xml"] = app.process_xml_content(doc, lang_code, tagger_function)
+    tokens = sum(count_tokens(xml) for xml in output_data.values())
+    seconds, _, peak = measure(lambda: app.create_zip_archive(output_data), repeat)
+    return [_stage_result("create_zip_archive", lang_code, "all", seconds, len(output_data), tokens, peak)]
+
+
+def bench_english_engines(lang_code, fixtures, repeat, reset):
+    """NLTK's perceptron vs VectorizedPerceptronTagger on the same sentences; their tags must match."""
+    if lang_code != "EN":
+        return []
+    from nltk.tag.perceptron import PerceptronTagger
+    from nltk.tokenize import sent_tokenize, word_tokenize
+
+    sentences = [word_tokenize(s) for doc in fixtures["flat_text"] for s in sent_tokenize(doc)]
+    tokens = sum(len(sentence) for sentence in sentences)
+    nltk_tagger = PerceptronTagger()
+    engines = {"nltk": nltk_tagger, "numpy": app.VectorizedPerceptronTagger.from_nltk(nltk_tagger)}
+    rows, outputs = [], {}
+    for name, engine in engines.items():
+        seconds, outputs[name], peak = measure(lambda: engine.tag_sents(sentences), repeat)
+        rows.append(_stage_result(f"perceptron_{name}", lang_code, "flat_text", seconds, len(sentences), tokens, peak))
+    if outputs["numpy"] != outputs["nltk"]:
+        raise AssertionError("VectorizedPerceptronTagger tags differ from NLTK's PerceptronTagger")
+    return rows
+
+
+def bench_xml_backends(lang_code, fixtures, repeat, reset):
+    """Parse and serialize time of each XML backend, without tagging."""
+    rows = []
+    for fixture in ("nested_xml", "large_single_file"):
+        wrapped = [f"<TEMP_WRAPPER>{app.XML_DECLARATION_PATTERN.sub('', doc)}</TEMP_WRAPPER>"
+                   for doc in fixtures[fixture]]
+        for name in app.XML_BACKEND_CLASSES:
+            backend = app.get_xml_backend(name)
+            if backend.name != name:
+                print(f"Skipped {name} XML backend: not installed", file=sys.stderr)
+                continue
+            seconds, roots, peak = measure(lambda: [backend.fromstring(doc) for doc in wrapped], repeat)
+            rows.append(_stage_result(f"parse_{name}", lang_code, fixture, seconds, len(wrapped), 0, peak))
+            seconds, _, peak = measure(lambda: [backend.tostring(root) for root in roots], repeat)
+            rows.append(_stage_result(f"serialize_{name}", lang_code, fixture, seconds, len(wrapped), 0, peak))
+    return rows
+
+
+DEEP_XML_DEPTH = 10_000
+
+
+def bench_deep_xml(lang_code, fixtures, repeat, reset):
+    """
+    Parse, segment collection and serialization of a document nested
+    DEEP_XML_DEPTH levels deep with about a million elements, plus the full
+    process_xml_bytes pipeline on a chain as deep. Only ElementTree is timed:
+    libxml2 refuses nesting beyond 2048 levels. The documents column of the
+    first three rows counts elements.
+    """
+    depth = DEEP_XML_DEPTH
+    rng = random.Random(0)
+    backend = app.get_xml_backend("stdlib")
+    document = make_deep_xml(lang_code, depth, 100, rng).encode("utf-8")
+    elements = depth * 101 + 2
+
+    seconds, root, peak = measure(lambda: backend.parse_wrapped(document), repeat)
+    rows = [_stage_result("parse_stdlib", lang_code, "deep_xml", seconds, elements, 0, peak)]
+    seconds, segments, peak = measure(lambda: app.collect_text_segments(root), repeat)
+    rows.append(_stage_result("collect_text_segments", lang_code, "deep_xml", seconds, elements, 0, peak))
+    seconds, _, peak = measure(lambda: backend.tobytes(root[0]), repeat)
+    rows.append(_stage_result("serialize_stdlib", lang_code, "deep_xml", seconds, elements, 0, peak))
+    del root, segments
+
+    chain = make_deep_xml(lang_code, depth, 1, rng).encode("utf-8")
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    seconds, result, peak = measure(lambda: app.process_xml_bytes(chain, lang_code, tagger_function), repeat, reset)
+    rows.append(_stage_result("process_xml_bytes", lang_code, "deep_chain", seconds, 1, result.count(b"\t") // 2, peak))
+    return rows
+
+
+def bench_parallel_text(lang_code, fixtures, repeat, reset):
+    """
+    One large plain text (the flat_text fixture joined) tagged in one call,
+    chunk by chunk in this process and with tag_text_parallel over every
+    core; all three must give the same tagged lines.
+    """
+    tagger_function = app.TAGGER_FUNCTIONS[lang_code]
+    text = "\n\n".join(fixtures["flat_text"])
+    workers = os.cpu_count() or 1
+    # Several chunks per worker even at small --scale
+    chunk_chars = min(app.PARALLEL_CHUNK_CHARS, max(1 << 14, len(text) // (4 * workers)))
+    chunks = app.split_text_at_sentences(text, lang_code, chunk_chars)
+    seconds, whole, peak = measure(lambda: tagger_function(text), repeat, reset)
+    rows = [_stage_result("tag_text_serial", lang_code, "joined_text", seconds, 1, len(whole), peak)]
+    seconds, serial, peak = measure(lambda: [line for chunk in chunks for line in tagger_function(chunk)], repeat, reset)
+    rows.append(_stage_result("tag_chunks_serial", lang_code, "joined_text", seconds, len(chunks), len(serial), peak))
+    seconds, parallel, peak = measure(lambda: app.tag_text_parallel(text, lang_code, workers, chunk_chars), repeat, reset)
+    rows.append(_stage_result(f"tag_text_parallel_{workers}", lang_code, "joined_text", seconds, len(chunks),
+                              len(parallel), peak))
+    if serial != whole:
+        raise AssertionError("tagging the chunks serially differs from tagging the whole text")
+    if parallel != whole:
+        raise AssertionError("tag_text_parallel output differs from tagging the whole text")
+    return rows
+
+
+STAGES = {
+    "tagger": bench_tagger,
+    "english_engines": bench_english_engines,
+    "process_xml": bench_process_xml,
+    "xml_backends": bench_xml_backends,
+    "process_bytes": bench_process_bytes,
+    "deep_xml": bench_deep_xml,
+    "process_stream": bench_process_stream,
+    "parallel_text": bench_parallel_text,
+    "zip": bench_zip,
+}
+
+
+# --- Reporting ---
+
+COLUMNS = ("stage", "lang", "fixture", "documents", "tokens", "seconds", "docs_per_sec", "tokens_per_sec", "peak_mb")
+
+
+def print_table(rows):
+    widths = {column: max(len(column), *(len(str(row.get(column))) for row in rows)) for column in COLUMNS}
+    print("  ".join(column.ljust(widths[column]) for column in COLUMNS))
+    for row in rows:
+        print("  ".join(str(row.get(column)).ljust(widths[column]) for column in COLUMNS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tagging pipeline.")
+    parser.add_argument("--lang", nargs="+", choices=sorted(app.TAGGER_FUNCTIONS), default=sorted(app.TAGGER_FUNCTIONS))
+    parser.add_argument("--stage", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--scale", type=int, default=1, help="Multiplies the size of every fixture.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the best is reported.")
+    parser.add_argument("--keep-memo", action="store_true",
+                        help="Keep the segment memo warm between runs instead of clearing it.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    reset = None if args.keep_memo else app.SEGMENT_MEMO.clear
+    rows = []
+    failed = []
+    for lang_code in args.lang:
+        fixtures = build_fixtures(lang_code, args.scale)
+        for stage in args.stage:
+            try:
+                rows.extend(STAGES[stage](lang_code, fixtures, args.repeat, reset))
+            except AssertionError as e:
+                # An output check failed: the stage ran but its result is wrong
+                failed.append(f"{stage} ({lang_code})")
+                print(f"FAILED {stage} ({lang_code}): {e}", file=sys.stderr)
+            except Exception as e:
+                message = str(e).strip().splitlines()[0] if str(e).strip() else ""
+                print(f"Skipped {stage} ({lang_code}): {type(e).__name__} {message}", file=sys.stderr)
+
+    if rows:
+        print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "cpu_count": os.cpu_count(), "results": rows,
+                       "failed": failed}, f, indent=2)
+    if failed:
+        print(f"Failed output checks: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""
+Entry points for the tagging worker processes.
+
+Worker pools pickle their functions by module and name. Under Streamlit the
+app script runs as a `__main__` module that is replaced on every rerun, so
+functions defined in app.py cannot be found again by the time a worker asks
+for them; the pools use these functions instead. `app` is imported inside
+each function, so importing this module from app.py loads nothing twice.
+"""
+
+
+def init_worker(lang_code):
+    """Runs once in each worker process: loads the worker's own tagger up front."""
+    import app
+    # The parent has already reported a missing lemma table. If the tagger
+    # itself fails to load, leave it to load_language_backend to report.
+    try:
+        with app.collect_pipeline_warnings():
+            app.init_language_backend(lang_code)
+    except Exception:
+        pass
+
+
+def process_file(filename, content_bytes, lang_code, with_token_rows=False, rules=None, incremental=False):
+    """
+    Decodes and tags one whole file. rules is an optional (include, exclude)
+    pair of rule lists, rebuilt into an ElementSelection here.
+    """
+    import app
+    selection = app.ElementSelection(*rules) if rules else None
+    token_rows = [] if with_token_rows else None
+    processed_xml, metrics = app.process_file_bytes(filename, content_bytes, lang_code,
+                                                    app.TAGGER_FUNCTIONS[lang_code], token_rows=token_rows,
+                                                    selection=selection, incremental=incremental)
+    return processed_xml, metrics, token_rows
+
+
+def tag_text(lang_code, text):
+    """Tags one chunk of text with the built-in tagger for lang_code."""
+    import app
+    return app.TAGGER_FUNCTIONS[lang_code](text)
@@ -0,0 +1,530 @@
+"""
+Behaviour checks for the tagging pipeline.
+
+    python -m pytest -q
+
+Tagging goes through a whitespace tagger, so no language backend is needed;
+checks that need NLTK or lxml skip without them.
+"""
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def fake_tagger(text):
+    """Tags every whitespace-separated word as X, with the lowercased word as lemma."""
+    return [f"{word}\tX\t{word.lower()}" for word in text.split()]
+
+
+# --- XML repair ---
+
+@pytest.mark.parametrize("text, repaired, repairs", [
+    ("<p>caf&eacute; &nbsp;x &#233; &amp;</p>", "<p>café \xa0x &#233; &amp;</p>", {"entities": 2}),
+    ("<p>a & b &unknown; c</p>", "<p>a &amp; b &amp;unknown; c</p>", {"entities": 1, "ampersands": 1}),
+    ("<p>1 < 2 <3</p>", "<p>1 &lt; 2 &lt;3</p>", {"brackets": 2}),
+    ("<p a=1 b='x' c=\"y\">t</p>", '<p a="1" b="x" c="y">t</p>', {"attributes": 1}),
+    ("<d><p>one<p>two</d>", "<d><p>one<p>two</p></p></d>", {"unclosed_tags": 2}),
+    ("<d>x</q></d>", "<d>x</d>", {"stray_end_tags": 1}),
+    ("<!DOCTYPE html><d>x</d>", "<d>x</d>", {"declarations": 1}),
+    ("<d><p>valid &amp; <b>fine</b></p></d>", "<d><p>valid &amp; <b>fine</b></p></d>", {}),
+])
+def test_repair_xml(text, repaired, repairs):
+    output, repairer = app.repair_xml(text)
+    assert output == repaired
+    assert {kind: count for kind, count in repairer.repairs.items() if count} == repairs
+    assert repairer.repair_count == sum(repairs.values())
+
+
+def test_repairer_output_does_not_depend_on_chunking():
+    text = "<d a=1><p>caf&eacute; & <b>x</p> 1 < 2</q>" * 50
+    expected, _ = app.repair_xml(text)
+    for size in (1, 7, 64):
+        repairer = app.XMLRepairer()
+        pieces = [repairer.feed(text[start:start + size]) for start in range(0, len(text), size)]
+        pieces.append(repairer.close())
+        assert ''.join(pieces) == expected
+
+
+def test_malformed_xml_keeps_markup_and_counts_repairs():
+    metrics = app.new_file_metrics("doc.xml")
+    output = app.process_xml_content("<d><p>a &nbsp; b</d>", "EN", fake_tagger, metrics=metrics,
+                                     xml_backend="stdlib")
+    assert output == "<d><p>\na\tX\ta\nb\tX\tb\n</p></d>"  # &nbsp; became a (non-breaking) space
+    assert metrics["repairs"] == 2
+
+
+def test_unrepairable_input_is_tagged_as_raw_text(monkeypatch):
+    monkeypatch.setattr(app, "XML_RECOVER", False)
+    output = app.process_xml_content("a < b", "EN", fake_tagger, xml_backend="stdlib")
+    assert output == '<text lang="EN">\na\tX\ta\n<\tX\t<\nb\tX\tb\n</text>'
+
+
+# --- Element rules ---
+
+@pytest.mark.parametrize("rule", ["a[", "/", "a//", "[@x]", "a[@x=y]", "a/[@x]", ""])
+def test_invalid_element_rules(rule):
+    with pytest.raises(ValueError):
+        app.ElementRule(rule)
+
+
+TEI = ("<TEI><teiHeader><title>head</title></teiHeader>"
+       "<text><body><p>one <note place='foot'>foot</note> two</p>"
+       "<div type='meta'><p>meta</p></div>"
+       "<div type='chapter'><p>chap <hi>bold</hi> end</p></div></body></text></TEI>")
+
+
+def selected_text(include=(), exclude=()):
+    root = app.get_xml_backend("stdlib").fromstring(f"<TEMP_WRAPPER>{TEI}</TEMP_WRAPPER>")
+    selection = app.ElementSelection(include, exclude)
+    return [getattr(element, attribute).strip() for element, attribute in app.collect_text_segments(root, selection)]
+
+
+@pytest.mark.parametrize("include, exclude, expected", [
+    ((), (), ["head", "one", "foot", "two", "meta", "chap", "bold", "end"]),
+    ((), ("teiHeader", "note"), ["one", "two", "meta", "chap", "bold", "end"]),
+    ((), ("/TEI/teiHeader", "@type='meta'"), ["one", "foot", "two", "chap", "bold", "end"]),
+    ((), ("/teiHeader",), ["head", "one", "foot", "two", "meta", "chap", "bold", "end"]),
+    ((), ("note[@place='foot']",), ["head", "one", "two", "meta", "chap", "bold", "end"]),
+    ((), ("note[@place!='foot']",), ["head", "one", "foot", "two", "meta", "chap", "bold", "end"]),
+    (("body//p",), ("note",), ["one", "two", "meta", "chap", "bold", "end"]),
+    (("div[@type='chapter']",), (), ["chap", "bold", "end"]),
+    (("text/body/div/p",), ("hi",), ["meta", "chap", "end"]),
+    (("TEI//div//hi",), (), ["bold"]),
+    (("*[@type]",), ("div[@type!='chapter']",), ["chap", "bold", "end"]),
+])
+def test_element_selection(include, exclude, expected):
+    assert selected_text(include, exclude) == expected
+
+
+def test_element_rules_ignore_namespaces():
+    document = '<tei:TEI xmlns:tei="urn:tei"><tei:note tei:place="foot">x</tei:note><tei:p>y</tei:p></tei:TEI>'
+    root = app.get_xml_backend("stdlib").fromstring(f"<TEMP_WRAPPER>{document}</TEMP_WRAPPER>")
+    selection = app.ElementSelection(exclude=["TEI/note[@place='foot']"])
+    assert [element.text for element, _ in app.collect_text_segments(root, selection)] == ["y"]
+
+
+def test_descendant_rules_scale_with_depth():
+    depth = 20_000
+    document = ("<q>" + "<d>" * depth + "x" + "</d>" * depth + "</q>").encode()
+    start = time.perf_counter()
+    output = app.process_xml_bytes(document, "EN", fake_tagger, xml_backend="stdlib",
+                                   selection=app.ElementSelection(exclude=["q//d//d"]))
+    assert time.perf_counter() - start < 10
+    assert b"\tX\t" not in output
+
+
+# --- Result cache ---
+
+def cache_sizes(directory):
+    return {path.name: path.stat().st_size for path in directory.rglob("*.xml")}
+
+
+def test_result_cache_evicts_least_recently_used_entries(tmp_path):
+    cache = app.ResultCache(str(tmp_path), max_bytes=1000)
+    for age, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.put(key, b"x" * 300)
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+    assert cache.get("aa1") == b"x" * 300  # a hit makes aa1 the most recently used entry
+    cache.put("dd4", b"x" * 300)  # 1200 bytes: evict down to 90% of max_bytes
+    assert sorted(cache_sizes(tmp_path)) == ["aa1.xml", "cc3.xml", "dd4.xml"]
+    assert cache.get("bb2") is None
+    assert cache._size == sum(cache_sizes(tmp_path).values()) == 900
+
+
+def test_result_cache_counts_replaced_entries_once(tmp_path):
+    cache = app.ResultCache(str(tmp_path), max_bytes=1000)
+    cache.put("aa1", b"x" * 100)
+    cache.put("bb2", b"x" * 200)
+    cache.put("aa1", b"x" * 50)
+    assert cache._size == sum(cache_sizes(tmp_path).values()) == 250
+
+
+def test_disabled_result_cache_stores_nothing(tmp_path):
+    cache = app.ResultCache(str(tmp_path), max_bytes=0)
+    cache.put("aa1", b"x")
+    assert cache.get("aa1") is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_output_of_a_missing_backend_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "RESULT_CACHE", app.ResultCache(str(tmp_path), max_bytes=1 << 20))
+    monkeypatch.setattr(app, "load_language_backend", lambda lang_code: None)
+    monkeypatch.setattr(app, "ENGLISH_TAGGER", None)
+    text = "<d>nothing to see here</d>"
+    output = app.process_bytes(text.encode(), "EN", app.run_tagger_english)
+    assert output == b"<d>\n\n</d>"
+    assert not list(tmp_path.rglob("*.xml"))
+    assert app.SEGMENT_MEMO.get(app.run_tagger_english, "nothing to see here") is None
+
+
+# --- Segment memo ---
+
+def test_segment_memo_is_bounded_by_entries_in_lru_order():
+    memo = app.SegmentMemo(max_entries=2, max_chars=1000, max_segment_chars=100)
+    memo.put(fake_tagger, "a", ["a"])
+    memo.put(fake_tagger, "b", ["b"])
+    assert memo.get(fake_tagger, "a") == ["a"]  # now b is the least recently used
+    memo.put(fake_tagger, "c", ["c"])
+    assert memo.get(fake_tagger, "b") is None
+    assert memo.get(fake_tagger, "a") == ["a"] and memo.get(fake_tagger, "c") == ["c"]
+    assert memo.stats() == {"hits": 3, "misses": 1, "entries": 2, "chars": 4}
+
+
+def test_segment_memo_is_bounded_by_characters():
+    memo = app.SegmentMemo(max_entries=100, max_chars=20, max_segment_chars=100)
+    for text in ["aaaa", "bbbb", "cccc"]:
+        memo.put(fake_tagger, text, [text + "\tX"])  # 4 + 6 characters each
+    assert memo.get(fake_tagger, "aaaa") is None
+    assert memo.stats()["chars"] == 20
+    memo.put(fake_tagger, "cccc", ["c"])  # a replaced entry is counted once
+    assert memo.stats()["chars"] == 15
+    memo.put(fake_tagger, "d" * 101, ["d"])  # longer than max_segment_chars: not kept
+    assert memo.get(fake_tagger, "d" * 101) is None
+    assert memo.stats()["entries"] == 2
+
+
+def test_tag_segments_tags_repeated_segments_once(monkeypatch):
+    monkeypatch.setattr(app, "SEGMENT_MEMO", app.SegmentMemo(100, 1000, 100))
+    calls = []
+
+    def tagger(text):
+        calls.append(text)
+        return fake_tagger(text)
+
+    assert app.tag_segments(["one", "two"], tagger) == [["one\tX\tone"], ["two\tX\ttwo"]]
+    assert app.tag_segments(["two", "three"], tagger) == [["two\tX\ttwo"], ["three\tX\tthree"]]
+    assert calls == ["one", "two", "three"]
+
+
+# --- Incremental re-tagging ---
+
+@pytest.fixture
+def counted_en_tagger(tmp_path, monkeypatch):
+    """Installs fake_tagger as the built-in EN tagger, with a fresh result cache and no memo; returns its calls."""
+    calls = []
+
+    def tagger(text):
+        calls.append(text)
+        return fake_tagger(text)
+    monkeypatch.setitem(app.TAGGER_FUNCTIONS, "EN", tagger)
+    monkeypatch.setattr(app, "load_language_backend", lambda lang_code: None)
+    monkeypatch.setattr(app, "ENGLISH_TAGGER", object())
+    monkeypatch.setattr(app, "RESULT_CACHE", app.ResultCache(str(tmp_path), max_bytes=1 << 20))
+    monkeypatch.setattr(app, "SEGMENT_MEMO", app.SegmentMemo(0, 0, 0))
+    return calls
+
+
+def test_incremental_run_tags_only_changed_segments(counted_en_tagger):
+    tagger = app.TAGGER_FUNCTIONS["EN"]
+    first = b"<d><p>one</p><p>two</p><p>three</p></d>"
+    app.process_file_bytes("doc.xml", first, "EN", tagger, incremental=True)
+    assert counted_en_tagger == ["one", "two", "three"]
+
+    counted_en_tagger.clear()
+    # A new first paragraph moves every old one to another path: they are found by their text
+    edited = b"<d><p>zero</p><p>one</p><p>two</p><p>three, edited</p></d>"
+    output, metrics = app.process_file_bytes("doc.xml", edited, "EN", tagger, incremental=True)
+    assert counted_en_tagger == ["zero", "three, edited"]
+    assert metrics["reused_segments"] == 2
+    assert output == app.process_xml_bytes(edited, "EN", fake_tagger)
+
+
+def test_incremental_runs_are_kept_per_file_name(counted_en_tagger):
+    tagger = app.TAGGER_FUNCTIONS["EN"]
+    app.process_file_bytes("a.xml", b"<d><p>one</p></d>", "EN", tagger, incremental=True)
+    counted_en_tagger.clear()
+    app.process_file_bytes("b.xml", b"<d><p>one</p><p>two</p></d>", "EN", tagger, incremental=True)
+    assert counted_en_tagger == ["one", "two"]
+
+
+# --- Splitting large texts ---
+
+def test_japanese_text_is_split_after_sentence_ends():
+    rng = random.Random(0)
+    sentences = ["吾輩は猫である。", "名前はまだ無い！", "「どこで生れたか。」", "何でも薄暗い所で泣いていた？\n", "今日は晴れ"]
+    text = "".join(rng.choice(sentences) for _ in range(500))
+    chunks = app.split_text_at_sentences(text, "JP", chunk_chars=200)
+    assert "".join(chunks) == text
+    assert len(chunks) > 10
+    for chunk in chunks[:-1]:
+        assert app.JAPANESE_SENTENCE_END.search(chunk[-3:]), chunk[-10:]
+
+
+def test_text_without_a_boundary_stays_whole():
+    text = "あ" * 1000
+    assert app.split_text_at_sentences(text, "JP", chunk_chars=100) == [text]
+
+
+def test_english_text_is_split_at_punkt_sentence_starts():
+    pytest.importorskip("nltk")
+    from nltk.tokenize import PunktTokenizer
+    try:
+        punkt = PunktTokenizer("english")
+    except LookupError:
+        pytest.skip("NLTK punkt data is not installed")
+    rng = random.Random(0)
+    sentences = ["The cat sat on the mat. ", "Dr. Smith went to Washington. ", "He said \"Hello!\" and left. ",
+                 "U.S. sales rose 5 percent in Jan. and Feb. ", "Why not?\n\n"]
+    text = "".join(rng.choice(sentences) for _ in range(300))
+    chunks = app.split_text_at_sentences(text, "EN", chunk_chars=500)
+    assert "".join(chunks) == text
+    assert len(chunks) > 10
+    starts = {start for start, _ in punkt.span_tokenize(text)}
+    offsets = [sum(map(len, chunks[:i])) for i in range(1, len(chunks))]
+    assert set(offsets) <= starts
+
+
+@pytest.mark.parametrize("text, pieces", [
+    ("短い文。", ["短い文。"]),  # no longer than max_chars: one piece
+    ("一文目。二文目」。三", ["一文目。", "二文目」。", "三"]),
+    ("「はい。」と言った。次", ["「はい。」", "と言った。", "次"]),  # closing quotes stay with their sentence
+    ("改行の前\n改行の後", ["改行の前\n", "改行の後"]),  # no sentence end: cut after a line break
+    ("あいうえおかきくけこさ", ["あいうえお", "かきくけこ", "さ"]),  # neither: cut at max_chars
+])
+def test_japanese_pieces(text, pieces):
+    assert list(app.iter_japanese_pieces(text, max_chars=5)) == pieces
+
+
+# --- String, bytes and stream paths ---
+
+PARITY_DOCUMENTS = [
+    "plain text without markup",
+    "<d><p>Hello <b>big</b> world</p>tail text<e/></d>",
+    '<?xml version="1.0" encoding="UTF-8"?>\n<d a="x &amp; y" b="1&#10;2"><p>1 &lt; 2</p></d>',
+    "<a>one</a> between <b>two</b>",
+    "<d><p>broken &nbsp; <q>entity</d>",
+    "<d>" * 3000 + "deep" + "</d>" * 3000,
+]
+
+
+@pytest.mark.parametrize("document", PARITY_DOCUMENTS)
+@pytest.mark.parametrize("selection", [None, app.ElementSelection(exclude=["b", "q"])])
+def test_string_bytes_and_stream_paths_agree(document, selection):
+    string_rows, bytes_rows = [], []
+    from_string = app.process_xml_content(document, "EN", fake_tagger, token_rows=string_rows,
+                                          xml_backend="stdlib", selection=selection)
+    from_bytes = app.process_xml_bytes(document.encode(), "EN", fake_tagger, token_rows=bytes_rows,
+                                       xml_backend="stdlib", selection=selection)
+    assert from_bytes.decode() == from_string
+    assert bytes_rows == string_rows
+
+    output = io.StringIO()
+    app.process_xml_stream(io.BytesIO(document.encode()), output, "EN", fake_tagger, chunk_size=16,
+                           selection=selection)
+    assert output.getvalue().strip() == from_string
+
+
+def stream(document, metrics=None, chunk_size=16):
+    output = io.StringIO()
+    app.process_xml_stream(io.BytesIO(document.encode()), output, "EN", fake_tagger, chunk_size=chunk_size,
+                           metrics=metrics)
+    return output.getvalue().strip()
+
+
+def test_stream_cuts_oversized_text_without_line_breaks(monkeypatch):
+    monkeypatch.setattr(app, "STREAM_MAX_SEGMENT_CHARS", 64)
+    words = "<d>" + "word " * 100 + "</d>"
+    metrics = app.new_file_metrics("words.xml")
+    assert stream(words, metrics) == app.process_xml_content(words, "EN", fake_tagger, xml_backend="stdlib")
+    assert metrics["segments"] > 1
+    # One giant token is cut at the buffer limit, so no text is lost or held back
+    metrics = app.new_file_metrics("token.xml")
+    output = stream("<d>" + "x" * 1000 + "</d>", metrics)
+    assert "".join(line.split("\t")[0] for line in output.splitlines() if "\t" in line) == "x" * 1000
+    assert metrics["segments"] >= 1000 // 64
+
+
+@pytest.mark.parametrize("recover", [True, False])
+def test_stream_counts_a_retried_file_once(monkeypatch, recover):
+    monkeypatch.setattr(app, "XML_RECOVER", recover)
+    monkeypatch.setattr(app, "STREAM_FLUSH_CHARS", 1)  # tag each element as it closes, before the error
+    document = "<d><p>one two</p><p>three &nbsp; four</d>"
+    expected = app.new_file_metrics("doc.xml")
+    app.process_xml_content(document, "EN", fake_tagger, metrics=expected, xml_backend="stdlib")
+    metrics = app.new_file_metrics("doc.xml")
+    stream(document, metrics)
+    assert (metrics["segments"], metrics["tokens"]) == (expected["segments"], expected["tokens"])
+
+
+def test_lxml_backend_keeps_tags_and_text():
+    pytest.importorskip("lxml")
+    document = "<d><p>Hello <b>big</b> world</p>tail<e/></d>"
+    stdlib = app.process_xml_content(document, "EN", fake_tagger, xml_backend="stdlib")
+    lxml = app.process_xml_content(document, "EN", fake_tagger, xml_backend="lxml")
+    assert lxml.replace("<e/>", "<e />") == stdlib
+
+
+def test_serialize_element_matches_elementtree():
+    import xml.etree.ElementTree as ET
+    root = ET.fromstring('<r xmlns="urn:a" xmlns:b="urn:b" xml:lang="en"><b:x b:y="&quot;&#10;&lt;">t &amp; &gt;'
+                         '</b:x>tail<h:p xmlns:h="http://www.w3.org/1999/xhtml"/></r>')
+    root.append(ET.Comment(" note "))
+    root.append(ET.ProcessingInstruction("pi", "x"))
+    assert app.serialize_element(root) == ET.tostring(root, encoding="unicode")
+
+
+@pytest.mark.parametrize("text", ["hello world", "hello & world"])
+def test_lxml_backend_falls_back_on_deep_documents(text):
+    pytest.importorskip("lxml")
+    depth = 3000  # deeper than libxml2's limit of 2048
+    document = "<a>" * depth + text + "</a>" * depth
+    stdlib = app.process_xml_content(document, "EN", fake_tagger, xml_backend="stdlib")
+    assert app.process_xml_content(document, "EN", fake_tagger, xml_backend="lxml") == stdlib
+    assert app.process_xml_bytes(document.encode(), "EN", fake_tagger, xml_backend="lxml") == stdlib.encode()
+
+
+# --- NumPy perceptron engine ---
+
+def test_vectorized_perceptron_matches_nltk():
+    pytest.importorskip("numpy")
+    perceptron = pytest.importorskip("nltk.tag.perceptron")
+    rng = random.Random(0)
+    vocabulary = {
+        "DT": ["the", "a", "this"], "NN": ["cat", "dog", "mat", "house", "run"],
+        "VB": ["run", "see", "like"], "VBD": ["ran", "saw", "liked"], "JJ": ["big", "red", "old"],
+        "IN": ["on", "in", "under"], "CD": ["1999", "42", "3rd"], ".": ["."], ",": [","],
+    }
+    patterns = [["DT", "JJ", "NN", "VBD", "IN", "DT", "NN", "."], ["DT", "NN", "VBD", ",", "CD", "NN", "."],
+                ["NN", "VB", "DT", "JJ", "NN"], ["CD", "JJ", "NN", "VBD", "."]]
+
+    def sentence():
+        return [(rng.choice(vocabulary[tag]), tag) for tag in rng.choice(patterns)]
+
+    random.seed(0)  # PerceptronTagger.train shuffles with the random module
+    tagger = perceptron.PerceptronTagger(load=False)
+    tagger.train([sentence() for _ in range(300)], nr_iter=3)
+    vectorized = app.VectorizedPerceptronTagger.from_nltk(tagger)
+
+    held_out = [[word for word, _ in sentence()] for _ in range(200)]
+    held_out += [["Unseen", "words", "-", "well-known", "1066", "x"], [], ["dog"]]
+    assert vectorized.tag_sents(held_out) == tagger.tag_sents(held_out)
+    assert vectorized.copy().tag_sents(held_out) == tagger.tag_sents(held_out)
+
+
+def test_english_tagger_falls_back_to_nltk_without_numpy(monkeypatch):
+    perceptron = pytest.importorskip("nltk.tag.perceptron")
+    untrained = perceptron.PerceptronTagger(load=False)
+    monkeypatch.setattr(perceptron, "PerceptronTagger", lambda: untrained)
+    monkeypatch.setattr(app, "ENGLISH_TAGGER_ENGINE", "numpy")
+    monkeypatch.setitem(sys.modules, "numpy", None)  # makes `import numpy` raise ImportError
+    assert app.build_english_tagger() is untrained
+
+# --- Tagger pool ---
+
+def test_tagger_pool_is_bounded_and_reuses_instances():
+    built = []
+    pool = app.TaggerPool(lambda: built.append(object()) or built[-1], 2)
+    holding = [threading.Event() for _ in range(3)]
+    release = threading.Event()
+    held = []
+
+    def hold(holding):
+        with pool.checkout() as tagger:
+            held.append(tagger)
+            holding.set()
+            release.wait()
+
+    threads = [threading.Thread(target=hold, args=(event,)) for event in holding]
+    threads[0].start()
+    threads[1].start()
+    holding[0].wait()
+    holding[1].wait()
+    threads[2].start()
+    assert not holding[2].wait(0.2)  # the third thread waits for a returned instance
+    assert len(built) == 2
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(held) == 3 and len(built) == 2
+    assert set(map(id, held)) == set(map(id, built))
+
+
+def test_tagger_pool_gives_up_the_slot_of_a_failed_build():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("model missing")
+        return "tagger"
+
+    pool = app.TaggerPool(factory, 1)
+    with pytest.raises(RuntimeError):
+        with pool.checkout():
+            pass
+    with pool.checkout() as tagger:
+        assert tagger == "tagger"
+
+
+# --- Command line ---
+
+@pytest.fixture
+def cli_tagger(monkeypatch):
+    """Runs the CLI's EN tagging through fake_tagger; the word 'boom' makes a file fail."""
+    def tagger(text):
+        if "boom" in text.split():
+            raise ValueError("boom")
+        return fake_tagger(text)
+    monkeypatch.setitem(app.TAGGER_FUNCTIONS, "EN", tagger)
+    monkeypatch.setattr(app, "init_language_backend", lambda lang_code: None)
+    monkeypatch.setattr(app, "ENGLISH_TAGGER", object())
+
+
+def test_cli_mirrors_the_input_layout(tmp_path, cli_tagger, capsys):
+    (tmp_path / "in" / "sub").mkdir(parents=True)
+    (tmp_path / "in" / "a.txt").write_text("one two")
+    (tmp_path / "in" / "notes.csv").write_text("not tagged")
+    (tmp_path / "in" / "sub" / "b.xml").write_text("<d>three</d>")
+    out = tmp_path / "out"
+    assert app.cli_main(["tag", "--lang", "EN", "--no-cache", str(tmp_path / "in"), str(out)]) == 0
+    assert sorted(path.relative_to(out).as_posix() for path in out.rglob("*.xml")) == \
+        ["a_tagged.xml", "sub/b_tagged.xml"]
+    assert (out / "sub" / "b_tagged.xml").read_text() == app.OUTPUT_XML_DECLARATION + "<d>\nthree\tX\tthree\n</d>"
+    assert "Done: 2 processed, 0 failed." in capsys.readouterr().out
+
+
+def test_cli_exit_status_counts_failed_files(tmp_path, cli_tagger, capsys):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.txt").write_text("one")
+    (tmp_path / "in" / "b.txt").write_text("boom")
+    assert app.cli_main(["tag", "--lang", "EN", "--no-cache", str(tmp_path / "in"), str(tmp_path / "out")]) == 1
+    captured = capsys.readouterr()
+    assert "Done: 1 processed, 1 failed." in captured.out
+    assert "b.txt: boom" in captured.err
+
+
+def test_cli_stops_when_the_tagger_cannot_load(tmp_path, monkeypatch, capsys):
+    def fail(lang_code):
+        raise LookupError("model missing")
+    monkeypatch.setattr(app, "init_language_backend", fail)
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.txt").write_text("one")
+    assert app.cli_main(["tag", "--lang", "EN", str(tmp_path / "in"), str(tmp_path / "out")]) == 1
+    assert "Could not load the EN tagger: model missing" in capsys.readouterr().err
+    assert not (tmp_path / "out").exists()
+
+
+def test_cli_does_not_overwrite_outputs_with_the_same_name(tmp_path, cli_tagger, capsys):
+    (tmp_path / "in").mkdir()
+    for name, text in [("a.txt", "one"), ("a.xml", "<d>two</d>"), ("a (1).xml", "<d>three</d>")]:
+        (tmp_path / "in" / name).write_text(text)
+    out = tmp_path / "out"
+    assert app.cli_main(["tag", "--lang", "EN", "--no-cache", str(tmp_path / "in"), str(out)]) == 1
+    assert (out / "a_tagged.xml").read_text() == app.OUTPUT_XML_DECLARATION + "<d>\nthree\tX\tthree\n</d>"
+    captured = capsys.readouterr()
+    assert "Done: 1 processed, 2 failed." in captured.out
+    assert captured.err.count("output name is already used by") == 2
+
+
+@pytest.mark.parametrize("options", [["--stream", "--workers", "2"], ["--stream", "--token-table", "arrow"],
+                                     ["--stream", "--incremental"]])
+def test_cli_rejects_conflicting_options(tmp_path, capsys, options):
+    assert app.cli_main(["tag", "--lang", "EN", *options, str(tmp_path), str(tmp_path / "out")]) == 2
+    assert "cannot be combined" in capsys.readouterr().err